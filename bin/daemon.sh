@@ -0,0 +1,69 @@
+#!/bin/bash
+
+# Keep running and rip every disc inserted into the optical drives, each with its own rip.sh.
+# https://github.com/Robpol86/makemkv/blob/master/bin/daemon.sh
+# Save as (chmod +x): /daemon.sh
+# Usage: daemon.sh [DEVICE...]. Defaults to DEVICES or else every /dev/sr* device.
+
+set -E  # Call ERR traps when using -e.
+set -e  # Exit script if a command fails.
+set -u  # Treat unset variables as errors and exit immediately.
+set -o pipefail  # Exit script if pipes fail instead of just the last program.
+
+# Source function library.
+source /env.sh
+
+# Print the identity of the disc in a drive (filesystem UUID and label) or nothing if the drive is empty.
+media_id () {
+    blkid -p -o export "$1" 2> /dev/null |grep -E '^(UUID|LABEL)=' |paste -sd ' ' || true
+}
+
+# Gather drives.
+declare -a devices=($(optical_devices "$@"))
+if [ ${#devices[@]} -eq 0 ]; then
+    echo -e "\nERROR: Unable to find optical devices.\n" >&2
+    exit 1
+fi
+
+# Set up once. Every rip.sh after this skips the mkv user and sudo setup and starts makemkvcon right away.
+setup
+export SETUP_DONE=true
+declare -gA SUPERVISE_PIDS=() SUPERVISE_WRITTEN=()
+declare -gi SUPERVISE_TITLES=0 SUPERVISE_BYTES=0
+declare -A device_run=() device_media=()
+declare -i status_at=$((SECONDS + STATUS_INTERVAL))
+trap supervise_term TERM
+if [ -n "$METRICS_DIR" ] && [ "$METRICS_PORT" -gt 0 ]; then
+    mkdir -p "$METRICS_DIR"
+    metrics_serve &
+    trap "kill $! 2> /dev/null; supervise_term" TERM
+    echo "Serving metrics of every rip on port $METRICS_PORT"
+fi
+echo "Watching ${#devices[@]} drives for discs: ${devices[*]}"
+
+# Poll every DAEMON_POLL seconds. A drive is only probed while it's not being ripped.
+while true; do
+    for device in "${devices[@]}"; do
+        run=${device_run[$device]:-}
+        if [ -n "$run" ]; then
+            if kill -0 "${SUPERVISE_PIDS[$run]}" 2> /dev/null; then continue; fi
+            wait "${SUPERVISE_PIDS[$run]}" || true  # Failures are read from the log below.
+            unset "SUPERVISE_PIDS[$run]" "SUPERVISE_WRITTEN[$run]" "device_run[$device]"
+            supervise_report "$run" || true
+        fi
+        media=$(media_id "$device")
+        if [ -z "$media" ] || [ "$media" == "${device_media[$device]:-}" ]; then
+            device_media[$device]=$media  # Forget ejected discs so the same disc is ripped again when reinserted.
+            continue
+        fi
+        device_media[$device]=$media
+        echo "Disc inserted in $device: $media"
+        INSERTED_AT=$(now) supervise_start "dev:$device"
+        device_run[$device]=$SUPERVISE_RUN
+    done
+    sleep "$DAEMON_POLL"
+    if [ "$STATUS_INTERVAL" -gt 0 ] && [ ${#SUPERVISE_PIDS[@]} -gt 0 ] && [ "$SECONDS" -ge "$status_at" ]; then
+        supervise_status
+        status_at=$((SECONDS + STATUS_INTERVAL))
+    fi
+done
@@ -0,0 +1,27 @@
+#!/bin/bash
+
+# Rip the discs in every attached optical drive at the same time, each with its own rip.sh.
+# https://github.com/Robpol86/makemkv/blob/master/bin/drives.sh
+# Save as (chmod +x): /drives.sh
+# Usage: drives.sh [DEVICE...]. Defaults to DEVICES or else every /dev/sr* device.
+
+set -E  # Call ERR traps when using -e.
+set -e  # Exit script if a command fails.
+set -u  # Treat unset variables as errors and exit immediately.
+set -o pipefail  # Exit script if pipes fail instead of just the last program.
+
+# Source function library.
+source /env.sh
+
+# Gather drives.
+declare -a devices=($(optical_devices "$@"))
+if [ ${#devices[@]} -eq 0 ]; then
+    echo -e "\nERROR: Unable to find optical devices.\n" >&2
+    exit 1
+fi
+
+# Rip. The mkv user and sudo are set up once here instead of by every rip.sh at the same time.
+setup
+export SETUP_DONE=true
+echo "Ripping ${#devices[@]} drives: ${devices[*]}"
+supervise ${#devices[@]} "${devices[@]/#/dev:}"
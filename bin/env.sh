@@ -1,22 +1,94 @@
 # Functions and variables to be used by scripts in this Docker container.
 
 # Define main variables with default options if not explicitly set by user.
+declare -xi DAEMON_POLL=${DAEMON_POLL:-2}
+declare -xi INGEST_JOBS=${INGEST_JOBS:-0}
+declare -xi INGEST_MEM_MB=${INGEST_MEM_MB:-1024}
+declare -xi JOB_CPU_WEIGHT=${JOB_CPU_WEIGHT:-10}
+declare -xi JOB_NICE=${JOB_NICE:-10}
+declare -xi JOBS_MAX=${JOBS_MAX:-0}
+declare -xi MAX_TITLES=${MAX_TITLES:-0}
+declare -xi METRICS_PORT=${METRICS_PORT:-0}
+declare -xi MIN_LENGTH=${MIN_LENGTH:-0}
+declare -xi MIRROR_JOBS=${MIRROR_JOBS:-2}
+declare -xi MIRROR_MBPS=${MIRROR_MBPS:-0}
 declare -xi MKV_GID=${MKV_GID:-0}
 declare -xi MKV_UID=${MKV_UID:-0}
+declare -xi PREALLOCATE_MB=${PREALLOCATE_MB:-0}
+declare -xi PROGRESS_INTERVAL=${PROGRESS_INTERVAL:-30}
+declare -xi REMUX_JOBS=${REMUX_JOBS:-0}
+declare -xi RIP_JOBS=${RIP_JOBS:-1}
+declare -xi RIP_NICE=${RIP_NICE:--5}
+declare -xi SCAN_CACHE_MB=${SCAN_CACHE_MB:-16}
+declare -xi SCRATCH_MIN_FREE_MB=${SCRATCH_MIN_FREE_MB:-4096}
+declare -xi SPACE_RESERVE_MB=${SPACE_RESERVE_MB:-256}
+declare -xi STATUS_INTERVAL=${STATUS_INTERVAL:-60}
+declare -xi WRITEBACK_MB=${WRITEBACK_MB:-0}
 declare -xl DEBUG=${DEBUG:-}
+declare -xl DROP_CACHE=${DROP_CACHE:-}
+declare -xl CATALOG=${CATALOG:-}
+declare -xl CHECKSUM=${CHECKSUM:-}
 declare -xl FAILED_EJECT=${FAILED_EJECT:-}
+declare -xl FORCE=${FORCE:-}
+declare -xl MAIN_FEATURE=${MAIN_FEATURE:-}
 declare -xl NO_EJECT=${NO_EJECT:-}
+declare -xl NO_RESUME=${NO_RESUME:-}
+declare -xl SKIP_DUPLICATES=${SKIP_DUPLICATES:-}
+declare -xl TRACE=${TRACE:-}
+declare -xl TRACE_IO=${TRACE_IO:-}
+declare -xl TRANSCODE=${TRANSCODE:-}
+export CATALOG_DB=${CATALOG_DB:-/output/.catalog}
+export DEVICES=${DEVICES:-}
 export DEVNAME=${DEVNAME:-}
+export DIR_CACHE=
 export DIR_FINAL=
+export DIR_MIRROR=
+export DIR_RESUME=
+export DIR_SCRATCH=
 export DIR_WORKING=
+export FAILURE_CODE=
+export FAILURE_RULES=${FAILURE_RULES:-/failures.tsv}
 export ID_FS_LABEL=${ID_FS_LABEL:-}
 export ID_FS_UUID=${ID_FS_UUID:-}
+export INSERTED_AT=${INSERTED_AT:-}
+export JOB_IO_MAX=${JOB_IO_MAX:-}
+export JOB_IONICE=${JOB_IONICE:-2:7}
+export METRICS_DIR=${METRICS_DIR:-}
+export MIRROR_DIR=${MIRROR_DIR:-}
+export RIP_IONICE=${RIP_IONICE:-2:0}
+export RIP_MODE=${RIP_MODE:-mkv}
+export RUN_DIR=${RUN_DIR:-/tmp}
+export SOURCE=${SOURCE:-}
+export STATUS_FILE=${STATUS_FILE:-}
+export SPACE_CHECK=${SPACE_CHECK:-}
+export TRANSCODE_ARGS=${TRANSCODE_ARGS:--c:v libx264 -crf 20 -c:a aac}
+export TRANSCODE_EXT=${TRANSCODE_EXT:-mp4}
 export UMASK=${UMASK:-$(umask)}
 
 # Set false booleans to null for fancy bash tricks in rip.sh.
+if [ "$CATALOG" != "true" ]; then CATALOG=; fi
+if [ "$CHECKSUM" != "true" ]; then CHECKSUM=; fi
 if [ "$DEBUG" != "true" ]; then DEBUG=; fi
+if [ "$DROP_CACHE" != "true" ]; then DROP_CACHE=; fi
 if [ "$FAILED_EJECT" != "true" ]; then FAILED_EJECT=; fi
+if [ "$FORCE" != "true" ]; then FORCE=; fi
+if [ "$MAIN_FEATURE" != "true" ]; then MAIN_FEATURE=; else MAX_TITLES=1; fi
 if [ "$NO_EJECT" != "true" ]; then NO_EJECT=; fi
+if [ "$NO_RESUME" != "true" ]; then NO_RESUME=; fi
+if [ "$SKIP_DUPLICATES" != "true" ]; then SKIP_DUPLICATES=; fi
+if [ "$TRACE" != "true" ]; then TRACE=; fi
+if [ "$TRACE_IO" != "true" ]; then TRACE_IO=; fi
+if [ "$TRANSCODE" != "true" ]; then TRANSCODE=; fi
+
+# Titles passed to makemkvcon, narrowed down by select_titles() and space_admit() using disc_scan().
+declare -a RIP_TITLES=(all)
+declare -A DISC_TITLE_BYTES=() DISC_TITLE_NAME=() DISC_TITLE_SECONDS=() DISC_TITLE_SEGMENTS=()
+
+# Digests of ripped titles by file name for the manifest (CHECKSUM=true) and mirror_check(), from wrappers.so or the
+# resume journal.
+declare -A TITLE_DIGESTS=()
+# Sizes of titles ripped by this run by file name, for space_watch().
+declare -A SPACE_DONE=()
 
 # Detect the device.
 if [ -z "$DEVNAME" ]; then
@@ -29,10 +101,16 @@ if [ -z "$DEVNAME" ]; then
     unset _device
 fi
 
+# Rip from the optical device unless given an ISO image or a folder (e.g. SOURCE=iso:/input/movie.iso, see ingest.sh).
+if [ -z "$SOURCE" ]; then SOURCE="dev:$DEVNAME"; fi
+if [ "${SOURCE%%:*}" != "dev" ]; then NO_EJECT=true; fi
+
 # Get disc label/UUID if not run through udev rule.
-if [ -n "$DEVNAME" ] && [ -b "$DEVNAME" ]; then
-    if [ -z "$ID_FS_LABEL" ]; then ID_FS_LABEL=$(blkid -o value -s LABEL "$DEVNAME" || true); fi
-    if [ -z "$ID_FS_UUID" ]; then ID_FS_UUID=$(blkid -o value -s UUID "$DEVNAME" || true); fi
+if [ -b "${SOURCE#*:}" ] || [ -f "${SOURCE#*:}" ]; then
+    if [ -z "$ID_FS_LABEL" ]; then ID_FS_LABEL=$(blkid -o value -s LABEL "${SOURCE#*:}" || true); fi
+    if [ -z "$ID_FS_UUID" ]; then ID_FS_UUID=$(blkid -o value -s UUID "${SOURCE#*:}" || true); fi
+elif [ -d "${SOURCE#*:}" ] && [ -z "$ID_FS_LABEL" ]; then
+    ID_FS_LABEL=$(basename "${SOURCE#*:}")
 fi
 
 # Write debug statements to stderr.
@@ -42,37 +120,89 @@ debug () {
     fi
 }
 
-# Source hook script if available.
+# Source hook script if available. With METRICS_DIR the time spent in it is recorded for the metrics file.
 hook () {
     local -x _HOOK_SCRIPT="/hook-$1.sh"
+    local _HOOK_STARTED
     if [ -s "$_HOOK_SCRIPT" ]; then
         debug "FIRING HOOK: $_HOOK_SCRIPT"
+        if [ -n "$METRICS_DIR" ]; then _HOOK_STARTED=$(now); fi
+        if [ -n "$TRACE" ]; then trace_event B "hook-$1"; fi
         source "$_HOOK_SCRIPT"
+        if [ -n "$TRACE" ]; then trace_event E "hook-$1"; fi
+        if [ -n "$METRICS_DIR" ]; then echo "$1 $(($(now) - _HOOK_STARTED))" >> "$RUN_DIR/metrics_hooks"; fi
         debug "END OF HOOK: $_HOOK_SCRIPT"
     fi
 }
 
+# Append a Chrome trace event to $RUN_DIR/trace_events. Timestamps come from /proc/uptime which is monotonic and needs
+# no fork (10 ms resolution). Events of subshells and background jobs land on their own row (tid). Arguments: phase (B
+# begins a span, E ends it, X is a complete span that just ended), name, duration in microseconds and tid for X.
+trace_event () {
+    local name=${2//\\/\\\\} up
+    local -i ts
+    read -r up _ < /proc/uptime
+    ts=$((10#${up/./} * 10000 - ${3:-0}))
+    name=${name//\"/\\\"}
+    printf '{"name": "%s", "ph": "%s", "ts": %d, %s"pid": %d, "tid": %d},\n' "$name" "$1" "$ts" \
+        "${3:+\"dur\": $3, }" $$ "${4:-$BASHPID}" >> "$RUN_DIR/trace_events"
+}
+
+# Run a command as a named span of the trace when TRACE is set. Arguments: span name, command...
+span () {
+    if [ -z "$TRACE" ]; then
+        "${@:2}"
+        return
+    fi
+    trace_event B "$1"
+    "${@:2}"
+    trace_event E "$1"
+}
+
+# Write the trace events of this rip to trace.json in DIR_FINAL, for chrome://tracing or https://ui.perfetto.dev.
+trace_write () {
+    {
+        echo '{"traceEvents": ['
+        printf '{"name": "process_name", "ph": "M", "pid": %d, "args": {"name": "rip.sh %s"}},\n' $$ "$SOURCE"
+        sed '$ s/,$//' "$RUN_DIR/trace_events"
+        echo '], "displayTimeUnit": "ms"}'
+    } |sudo -u mkv tee "$DIR_FINAL/trace.json" > /dev/null
+}
+
+# Eject the disc and record how long it took for the metrics file.
+eject_disc () {
+    local -i started
+    started=$(now)
+    eject ${DEBUG:+--verbose} "$DEVNAME"
+    echo $(($(now) - started)) > "$RUN_DIR/metrics_eject"
+}
+
 # Called when something errors out.
 on_err () {
     # Touch failed file.
     if [ -d "$DIR_FINAL" ]; then
         local -x _FAILED_FILE="$DIR_FINAL/failed"
         hook pre-on-err-touch
-        sudo -u mkv touch "$_FAILED_FILE"
+        echo "${FAILURE_CODE:-unknown}" |sudo -u mkv tee "$_FAILED_FILE" > /dev/null
         hook post-on-err-touch
     fi
 
+    # Record the failure in the catalog and metrics.
+    if [ -n "${CATALOG_RIP:-}" ]; then catalog_finish failed || true; fi
+    if [ -n "$METRICS_DIR" ]; then metrics_write failed || true; fi
+    if [ -n "$TRACE" ] && [ -d "$DIR_FINAL" ]; then trace_write || true; fi
+
     # Eject
     if [ "$NO_EJECT" != "true" ] && [ "$FAILED_EJECT" == "true" ]; then
         hook pre-failed-eject
         echo "Ejecting due to failure..."
-        eject ${DEBUG:+--verbose} "$DEVNAME"
+        eject_disc
         hook post-failed-eject
     fi
 }
 
-# Prepare the environment before ripping.
-prepare () {
+# Set up users, groups and sudo once per container.
+setup () {
     # Update UID and GID of "mkv" user at runtime.
     if [ "$MKV_UID" -ne "0" ] && [ "$MKV_UID" -ne "$(id -u mkv)" ]; then
         usermod -ou "$MKV_UID" mkv
@@ -86,48 +216,1196 @@ prepare () {
         groupmod -o --gid "$(stat -c %g "$DEVNAME")" cdrom
     fi
 
-    # Set umask.
-    umask "$UMASK"
+    # Set umask of sudo.
     EDITOR='tee -a' visudo <<< "Defaults umask = $UMASK"
+}
+
+# Prepare the environment before ripping.
+prepare () {
+    if [ -z "${SETUP_DONE:-}" ]; then span setup setup; fi
+    umask "$UMASK"
+
+    # Determine destination directory and set its permissions. Reuse the directory of a failed rip of the same disc.
+    if [ -n "$DIR_RESUME" ]; then
+        DIR_FINAL=$DIR_RESUME
+        DIR_WORKING="$DIR_FINAL/.rip"
+        rm -f "$DIR_FINAL/failed"
+        if [ ! -d "$DIR_WORKING" ]; then sudo -u mkv mkdir "$DIR_WORKING"; fi
+    else
+        DIR_FINAL=$(mktemp -d "/output/${ID_FS_LABEL:-nolabel}_${ID_FS_UUID:-nouuid}_XXX")
+        chown mkv:mkv "$DIR_FINAL"
+        DIR_WORKING="$DIR_FINAL/.rip"
+        sudo -u mkv mkdir "$DIR_WORKING" && chmod $(stat -c %a "$_") "$DIR_FINAL"
+        if [ -z "$NO_RESUME" ]; then disc_id && printf 'disc\t%s\n' "$DISC_ID" > "$DIR_FINAL/.journal"; fi
+    fi
+
+    # Mirror titles to a second volume as soon as they're done.
+    if [ -n "$MIRROR_DIR" ]; then
+        DIR_MIRROR="$MIRROR_DIR/$(basename "$DIR_FINAL")"
+        mkdir -p "$DIR_MIRROR" && chown mkv:mkv "$_" && chmod $(stat -c %a "$DIR_FINAL") "$_"
+    fi
+
+    # Keep disc scans in the cache volume if there is one.
+    if [ -d /cache ]; then DIR_CACHE=/cache; fi
+
+    # Rip to the fast scratch volume if there is one. Titles are migrated to DIR_FINAL as soon as they're done.
+    if [ -d /scratch ]; then
+        sudo -u mkv rmdir --ignore-fail-on-non-empty "$DIR_WORKING"  # May hold titles of a resumed rip.
+        DIR_SCRATCH=$(mktemp -d "/scratch/$(basename "$DIR_FINAL")_XXX")
+        chown mkv:mkv "$DIR_SCRATCH" && chmod $(stat -c %a "$DIR_FINAL") "$_"
+        DIR_WORKING="$DIR_SCRATCH"
+    fi
+}
+
+# Turn makemkvcon's progress lines into a status file and a "Progress:" line every PROGRESS_INTERVAL seconds (every
+# progress line if 0) with percent done, ETA and MB/s. Raw progress lines are only printed with DEBUG, other lines pass
+# through. The status file ($RUN_DIR/progress_NAME) has shell variables and is replaced atomically at most once a second.
+# Lines are also classified with the FAILURE_RULES table, the last code and message are written to $RUN_DIR/failure.
+# Exits 5 once a rule's threshold of lines in a row is crossed. Arguments: status file name, directory makemkvcon
+# writes to.
+progress_filter () {
+    awk -v debug="$DEBUG" -v interval="$PROGRESS_INTERVAL" -v status="$RUN_DIR/progress_$1" -v dir="$2" \
+            -v rules="$FAILURE_RULES" -v failure="$RUN_DIR/failure" '
+        function now() { srand(); return srand() }  # Seconds since the epoch in any awk.
+        function hms(s) { return s < 0 ? "--:--:--" : sprintf("%02d:%02d:%02d", s / 3600, s % 3600 / 60, s % 60) }
+        function eta(percent, since) {
+            return percent >= 100 ? 0 : percent > 0 ? int((t - since) * (100 - percent) / percent) : -1
+        }
+        function written(    cmd, size, sum) {
+            cmd = "find \"" dir "\" -maxdepth 1 -type f -printf \"%s\\n\" 2> /dev/null"
+            while ((cmd | getline size) > 0) sum += size
+            close(cmd)
+            return sum
+        }
+        function classify(    i) {
+            for (i = 1; i <= n; i++) if ($0 ~ pattern[i]) break
+            if (i > n) return 0
+            t = now()
+            if (!hits[i] || seconds[i] && t - first[i] > seconds[i]) {
+                hits[i] = 0
+                first[i] = t
+            }
+            hits[i]++
+            if (code[i] != classified) {
+                printf "%s\t%s\n", code[i], message[i] > failure
+                close(failure)
+                classified = code[i]
+            }
+            return count[i] && hits[i] >= count[i]
+        }
+        BEGIN {
+            FS = "\t"
+            while ((getline < rules) > 0) {
+                if (/^#/ || NF < 5) continue
+                n++
+                code[n] = $1; count[n] = $2; seconds[n] = $3; pattern[n] = $4; message[n] = $5
+            }
+            close(rules)
+            started = title_started = now()  # The first progress line is always logged.
+            started_bytes = log_bytes = written()
+        }
+        classify() { print; exit 5 }
+        /^Current progress - [0-9]+%/ {
+            t = now()
+            split($0, field, /[^0-9]+/)
+            if (field[2] + 0 != title_percent) split("", hits)  # Progress was made, failures so far are not in a row.
+            if (field[2] + 0 < title_percent) title_started = t
+            title_percent = field[2] + 0
+            total_percent = field[3] + 0
+            if (debug == "true") print
+            if (t > updated || total_percent == 100) {
+                bytes = written()
+                mbps = t > started && bytes > started_bytes ? (bytes - started_bytes) / (t - started) / 1e6 : 0
+                tmp = status ".tmp"
+                printf("TITLE_PERCENT=%d\nTITLE_ETA=%d\nTOTAL_PERCENT=%d\nTOTAL_ETA=%d\nBYTES=%.0f\nMBPS=%.2f\n",
+                    title_percent, eta(title_percent, title_started), total_percent, eta(total_percent, started),
+                    bytes, mbps) > tmp
+                printf("UPDATED=%d\n", t) > tmp
+                close(tmp)
+                system("mv -f \"" tmp "\" \"" status "\"")
+                updated = t
+            }
+            if (t - logged >= interval) {
+                mbps = t > logged && bytes > log_bytes ? (bytes - log_bytes) / (t - logged) / 1e6 : 0
+                printf "Progress: title %d%% ETA %s, total %d%% ETA %s, %.2f MB/s\n", title_percent,
+                    hms(eta(title_percent, title_started)), total_percent, hms(eta(total_percent, started)), mbps
+                logged = t
+                log_bytes = bytes
+            }
+            fflush()
+            next
+        }
+        { print; fflush() }
+    '
+}
 
-    # Determine destination directory and set its permissions.
-    DIR_FINAL=$(mktemp -d "/output/${ID_FS_LABEL:-nolabel}_${ID_FS_UUID:-nouuid}_XXX")
-    chown mkv:mkv "$DIR_FINAL"
-    DIR_WORKING="$DIR_FINAL/.rip"
-    sudo -u mkv mkdir "$DIR_WORKING" && chmod $(stat -c %a "$_") "$DIR_FINAL"
+# Filter makemkvcon output with progress_filter. Stop makemkvcon and exit 1 once a failure rule fires, it keeps going
+# no matter what (low disk space, read errors) and always exits 0 even when titles failed. Arguments: same as
+# progress_filter.
+makemkvcon_output () {
+    local ret=0 code message
+    progress_filter "$@" || ret=$?
+    if [ "$ret" -eq 5 ]; then
+        IFS=$'\t' read -r code message < "$RUN_DIR/failure"
+        echo -e "\nERROR: $message\n" >&2
+        sync
+        pkill -TERM -s 0 -x makemkvcon || true
+        exit 1
+    fi
 }
 
-# Kill makemkvcon when not enough disk space. It keeps going no matter what.
-low_space_term () {
-    local ret=0
-    sed -u "/much as [0-9]\+ megabytes while there are only/q5" || ret=$?
-    [ ${ret} -ne 5 ] && return
-    echo -e "\nERROR: Terminating MakeMKV due to low disk space.\n" >&2
-    sync
-    kill 0
+# Export FAILURE_CODE for on_err hooks: the last failure classified from makemkvcon output or else "unknown".
+failure_code () {
+    FAILURE_CODE=unknown
+    if [ -s "$RUN_DIR/failure" ]; then IFS=$'\t' read -r FAILURE_CODE _ < "$RUN_DIR/failure"; fi
 }
 
-# Exit 1 if any title failed to rip. makemkvcon always exits 0 for some reason.
-catch_failed () {
-    local ret=0
-    sed -u "/Copy complete. [0-9]\+ titles saved, [0-9]\+ failed./q5" || ret=$?
-    [ ${ret} -ne 5 ] && return
-    echo -e "\nERROR: One or more titles failed.\n" >&2
-    sync
-    exit 1
+# Forget the lines progress_filter() classified once makemkvcon succeeded anyway, so later failures of queued jobs or
+# hooks aren't blamed on them.
+failure_clear () {
+    rm -f "$RUN_DIR/failure"
 }
 
 # Run makemkvcon. In a function for job control in rip.sh. Function should always be run in the background.
 run_makemkvcon () {
     trap - ERR  # Disable error trap here to avoid firing error hooks twice.
-    sudo -u mkv LD_PRELOAD=/wrappers.so makemkvcon mkv ${DEBUG:+--debug} --progress -same --directio true \
-        "dev:$DEVNAME" all "$DIR_WORKING" \
-        |low_space_term \
-        |catch_failed
+    prioritize "$RIP_NICE" "$RIP_IONICE"
+    local -a preload=(LD_PRELOAD=/wrappers.so WRAPPERS_FIFO="$RUN_DIR/titles_done" WRAPPERS_PREFIX="$DIR_WORKING/")
+    if [ "$PREALLOCATE_MB" -gt 0 ]; then preload+=(WRAPPERS_FALLOCATE_MB="$PREALLOCATE_MB"); fi
+    if [ "$WRITEBACK_MB" -gt 0 ]; then preload+=(WRAPPERS_WRITEBACK_MB="$WRITEBACK_MB"); fi
+    if [ "$DROP_CACHE" == "true" ]; then preload+=(WRAPPERS_DROP_CACHE=true); fi
+    if [ -n "$CHECKSUM$MIRROR_DIR" ]; then preload+=(WRAPPERS_CHECKSUM=true); fi
+    if [ "${SOURCE%%:*}" == "dev" ]; then preload+=(WRAPPERS_DEVICE="${SOURCE#dev:}"); fi
+    # Every makemkvcon run (one per title when titles are picked) adds its reads to the trace file.
+    if [ "$TRACE_IO" == "true" ]; then
+        rm -f "$DIR_FINAL/io_trace.json"  # Left by a failed rip that is being resumed.
+        preload+=(WRAPPERS_TRACE_IO="$DIR_FINAL/io_trace.json")
+    elif [ -n "$METRICS_DIR" ]; then
+        : > "$RUN_DIR/metrics_trace.json" && chown mkv:mkv "$_"  # The run directory may not be writable by mkv.
+        preload+=(WRAPPERS_TRACE_IO="$RUN_DIR/metrics_trace.json")
+    fi
+    local -a args=(${DEBUG:+--debug} --progress -same --directio true)
+    if [ "$MIN_LENGTH" -gt 0 ]; then args+=(--minlength="$MIN_LENGTH"); fi
+    local title
+    local -a titles=()
+    if [ "${RIP_TITLES[*]}" == "none" ]; then return; fi
+    if [ "$RIP_MODE" == "backup" ]; then
+        backup_remux
+        return
+    fi
+    if [ "$(rip_jobs)" -gt 1 ]; then titles=($(rip_titles)); fi
+    if [ ${#titles[@]} -gt 1 ]; then
+        echo "Ripping ${#titles[@]} titles, $(rip_jobs) at a time..."
+        makemkvcon_parallel "$SOURCE" "$(rip_jobs)" "${titles[@]}"
+        return
+    fi
+    for title in "${RIP_TITLES[@]}"; do
+        makemkvcon_mkv "$SOURCE" "$title"
+    done
+}
+
+# Convert one title (or "all") from a source to MKV. Called by run_makemkvcon() which sets preload and args.
+makemkvcon_mkv () {
+    sudo -u mkv "${preload[@]}" makemkvcon mkv "${args[@]}" \
+        "$1" "$2" "$DIR_WORKING" \
+        |makemkvcon_output "$2" "$DIR_WORKING" || return
+    failure_clear
+}
+
+# Back up the decrypted disc in one sequential pass, eject it, then remux titles from the backup REMUX_JOBS at a time.
+backup_remux () {
+    local backup="$DIR_WORKING/.backup" title ret=0
+    local -i jobs=$REMUX_JOBS
+    if [ "$jobs" -le 0 ]; then jobs=$(cpu_count); fi
+
+    # Free the drive as soon as possible.
+    echo "Backing up disc..."
+    sudo -u mkv "${preload[@]}" makemkvcon backup --decrypt "${args[@]}" "$SOURCE" "$backup" \
+        |makemkvcon_output backup "$backup" || ret=$?
+    if [ "$ret" -ne 0 ] || [ ! -d "$backup" ]; then
+        echo -e "\nERROR: Disc backup failed.\n" >&2
+        return 1
+    fi
+    failure_clear
+    if [ "$NO_EJECT" != "true" ]; then
+        hook pre-success-eject
+        echo "Ejecting..."
+        eject_disc
+        hook post-success-eject
+    fi
+
+    # Remux in parallel.
+    if [ "${RIP_TITLES[*]}" == "all" ]; then
+        local -a info_args=(-r)  # Count the same titles the remux jobs number.
+        if [ "$MIN_LENGTH" -gt 0 ]; then info_args+=(--minlength="$MIN_LENGTH"); fi
+        read -r title < <(sudo -u mkv makemkvcon "${info_args[@]}" info "file:$backup" |sed -n 's/^TCOUNT://p')
+        RIP_TITLES=($(seq 0 $((${title:-1} - 1))))
+    fi
+    echo "Remuxing ${#RIP_TITLES[@]} titles, $jobs at a time..."
+    makemkvcon_parallel "file:$backup" "$jobs" "${RIP_TITLES[@]}" || return 1
+    sudo -u mkv rm -rf "$backup"
+}
+
+# Run makemkvcon_mkv for every title in the background, at most JOBS at once. Every process sends its titles to the same
+# named pipe. Arguments: source, jobs, titles... Returns 1 if any title failed.
+makemkvcon_parallel () {
+    local source=$1 title
+    local -i jobs=$2 running=0 failed=0
+    shift 2
+    for title in "$@"; do
+        if [ "$running" -ge "$jobs" ]; then
+            wait -n || failed+=1
+            running+=-1
+        fi
+        makemkvcon_mkv "$source" "$title" &
+        running+=1
+    done
+    while [ "$running" -gt 0 ]; do
+        wait -n || failed+=1
+        running+=-1
+    done
+    [ "$failed" -eq 0 ]
+}
+
+# Print how many makemkvcon processes rip titles at once: RIP_JOBS (the CPU quota if 0) for ISO images and folders.
+# Always 1 for optical drives, which would spend their time seeking between titles, and with RIP_MODE=backup.
+rip_jobs () {
+    local -i jobs=$RIP_JOBS
+    if [ "$jobs" -le 0 ]; then jobs=$(cpu_count); fi
+    if [ "${SOURCE%%:*}" == "dev" ] || [ "$RIP_MODE" == "backup" ]; then jobs=1; fi
+    echo "$jobs"
+}
+
+# Format bytes written over microseconds as MB/s with two decimals.
+mbps () {
+    local -i bytes=$1 usec=$2
+    if [ "$usec" -le 0 ]; then usec=1; fi
+    local -i rate=$((bytes * 100 / usec))
+    printf '%d.%02d' $((rate / 100)) $((rate % 100))
+}
+
+# Parse a title record written by wrappers.so into TITLE_* variables for hook-post-title.sh.
+parse_title () {
+    local usec
+    IFS=$'\t' read -r TITLE_PATH TITLE_BYTES TITLE_WRITES usec TITLE_WRITE_HIST TITLE_DIGEST <<< "$1"
+    printf -v TITLE_SECONDS '%d.%03d' $((usec / 1000000)) $((usec / 1000 % 1000))
+    TITLE_MBPS=$(mbps "$TITLE_BYTES" "$usec")
+    TITLES_DONE+=1
+    TITLES_BYTES+=$TITLE_BYTES
+    TITLES_USEC+=$usec
+}
+
+# Print milliseconds since the epoch, comparable with the timestamps in wrappers.so records.
+now () {
+    date +%s%3N
+}
+
+# Print milliseconds as seconds with three decimals (e.g. 1.250s). Negative values print as 0.000s.
+ms_seconds () {
+    local -i ms=$1
+    if [ "$ms" -lt 0 ]; then ms=0; fi
+    printf '%d.%03ds' $((ms / 1000)) $((ms % 1000))
+}
+
+# Print how long each step before the first makemkvcon event took: sourcing env.sh (with the post-env hook), preparing
+# (including the disc scan), makemkvcon starting until wrappers.so signalled it was ready, and that init record reaching
+# rip.sh. Arguments: init record, then rip.sh start, env done, prepare done and launch times from "now".
+startup_times () {
+    local -i ready=${1#*$'\t'} received
+    received=$(now)
+    echo "Startup: env $(ms_seconds $(($3 - $2))), prepare $(ms_seconds $(($4 - $3)))," \
+        "exec $(ms_seconds $((ready - $5))), first event $(ms_seconds $((received - ready)))"
+}
+
+# Print how long the drive took to deliver its first sector from a first_read record written by wrappers.so. Counted
+# from INSERTED_AT (milliseconds since the epoch, set by daemon.sh when it noticed the disc) or else from $2. Every
+# makemkvcon run sends one, only the first is printed.
+first_read () {
+    local since="rip.sh started"
+    if [ -n "${FIRST_READ_DONE:-}" ]; then return; fi
+    FIRST_READ_DONE=true
+    if [ -n "$INSERTED_AT" ]; then since="disc insertion"; fi
+    echo "First sector read $(ms_seconds $((${1#*$'\t'} - ${INSERTED_AT:-$2}))) after $since"
+}
+
+# Scan the disc with "makemkvcon info" and store each title's name, duration, size and segment map in DISC_TITLE_*.
+disc_scan () {
+    local line id attr value h m s
+    local -a args=(-r)
+    local -i started=$SECONDS
+    declare -gA DISC_TITLE_BYTES=() DISC_TITLE_NAME=() DISC_TITLE_SECONDS=() DISC_TITLE_SEGMENTS=()
+    if [ "$MIN_LENGTH" -gt 0 ]; then args+=(--minlength="$MIN_LENGTH"); fi
+    if ! scan_cache_get; then
+        sudo -u mkv makemkvcon "${args[@]}" info "$SOURCE" > "$RUN_DIR/disc_info.txt" || {
+            sed -n 's/^MSG:[0-9]*,[0-9]*,[0-9]*,"\([^"]*\)".*/\1/p' "$RUN_DIR/disc_info.txt"
+            echo -e "\nERROR: Failed to scan disc.\n" >&2
+            return 1
+        }
+        scan_cache_put $((SECONDS - started))
+    fi
+    while IFS= read -r line; do
+        [[ $line =~ ^TINFO:([0-9]+),([0-9]+),[0-9]+,\"(.*)\"$ ]] || continue
+        id=${BASH_REMATCH[1]} attr=${BASH_REMATCH[2]} value=${BASH_REMATCH[3]}
+        case $attr in
+            9) IFS=: read -r h m s <<< "$value"; DISC_TITLE_SECONDS[$id]=$((10#$h * 3600 + 10#$m * 60 + 10#$s)) ;;
+            11) DISC_TITLE_BYTES[$id]=$value ;;
+            26) DISC_TITLE_SEGMENTS[$id]=$value ;;
+            27) DISC_TITLE_NAME[$id]=$value ;;
+        esac
+    done < "$RUN_DIR/disc_info.txt"
+    for id in "${!DISC_TITLE_BYTES[@]}"; do
+        debug "DISC TITLE $id: ${DISC_TITLE_NAME[$id]:-?} ${DISC_TITLE_SECONDS[$id]:-0}s" \
+            "${DISC_TITLE_BYTES[$id]} bytes segments ${DISC_TITLE_SEGMENTS[$id]:-?}"
+    done
+}
+
+# Set DISC_ID to the disc's blkid identity plus a fingerprint of its first 2 MiB, which hold the filesystem structures
+# (and on DVDs the VIDEO_TS index files) and change whenever the disc does.
+disc_id () {
+    if [ -n "${DISC_ID:-}" ]; then return; fi
+    DISC_ID=$({
+        echo "$ID_FS_UUID $ID_FS_LABEL"
+        dd if="${SOURCE#*:}" bs=2048 count=1024 status=none 2> /dev/null || true
+    } |sha256sum |cut -c1-32)
+    debug "DISC ID: $DISC_ID"
+}
+
+# Update the hit/miss counters of the scan cache and print them. Arguments: hits, misses, seconds saved to add.
+scan_cache_count () {
+    local -i hits=0 misses=0 saved=0
+    if [ -s "$DIR_CACHE/stats" ]; then read -r hits misses saved < "$DIR_CACHE/stats"; fi
+    echo "$((hits + $1)) $((misses + $2)) $((saved + $3))" > "$DIR_CACHE/stats"
+    echo "$((hits + $1)) hits, $((misses + $2)) misses, $((saved + $3))s saved"
+}
+
+# Copy a cached disc scan to $RUN_DIR/disc_info.txt. Returns 1 on a miss or when there's no /cache volume.
+scan_cache_get () {
+    local seconds
+    if [ -z "$DIR_CACHE" ]; then return 1; fi
+    disc_id
+    SCAN_CACHE_FILE="$DIR_CACHE/${DISC_ID}_$MIN_LENGTH.txt"
+    if [ ! -s "$SCAN_CACHE_FILE" ]; then
+        debug "SCAN CACHE MISS: $SCAN_CACHE_FILE ($(scan_cache_count 0 1 0))"
+        return 1
+    fi
+    touch "$SCAN_CACHE_FILE"  # Least recently used files are evicted first.
+    read -r seconds < "$SCAN_CACHE_FILE"
+    tail -n +2 "$SCAN_CACHE_FILE" > "$RUN_DIR/disc_info.txt"
+    echo "Using cached disc scan."
+    debug "SCAN CACHE HIT: $SCAN_CACHE_FILE ($(scan_cache_count 1 0 "${seconds#CACHE:}"))"
+}
+
+# Store $RUN_DIR/disc_info.txt in the scan cache along with how long the scan took, then evict down to SCAN_CACHE_MB.
+scan_cache_put () {
+    local file
+    local -i total=0
+    if [ -z "$DIR_CACHE" ]; then return; fi
+    { echo "CACHE:$1"; cat "$RUN_DIR/disc_info.txt"; } > "$SCAN_CACHE_FILE"
+    while read -r file; do
+        total+=$(stat -c %s "$file")
+        if [ "$total" -gt $((SCAN_CACHE_MB * 1048576)) ]; then
+            debug "SCAN CACHE EVICT: $file"
+            rm -f "$file"
+        fi
+    done < <(ls -t "$DIR_CACHE/"*.txt)
+}
+
+# Quote a string for SQL.
+sql_quote () {
+    echo "'${1//\'/\'\'}'"
+}
+
+# Run SQL statements against the rip catalog.
+catalog_sql () {
+    sqlite3 -batch -cmd '.timeout 10000' "$CATALOG_DB" "$@"
+}
+
+# Create the rip catalog if needed and identify the disc.
+catalog_init () {
+    disc_id
+    catalog_sql "
+        CREATE TABLE IF NOT EXISTS rips (
+            id INTEGER PRIMARY KEY, disc TEXT NOT NULL, uuid TEXT, label TEXT, dir TEXT, status TEXT NOT NULL,
+            started INTEGER, finished INTEGER, titles INTEGER, bytes INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS rips_disc ON rips (disc, status);
+        CREATE TABLE IF NOT EXISTS titles (
+            rip INTEGER NOT NULL REFERENCES rips (id), name TEXT NOT NULL, bytes INTEGER, seconds INTEGER,
+            rip_ms INTEGER, sha256 TEXT, digest TEXT, status TEXT NOT NULL, PRIMARY KEY (rip, name)
+        );"
+    if ! catalog_sql "SELECT digest FROM titles LIMIT 0;" &> /dev/null; then  # Catalogs from before CHECKSUM.
+        catalog_sql "ALTER TABLE titles ADD COLUMN digest TEXT;"
+    fi
+}
+
+# Print the directory of the latest successful rip of this disc, if any.
+catalog_lookup () {
+    catalog_sql "SELECT dir FROM rips WHERE disc = '$DISC_ID' AND status = 'done' ORDER BY finished DESC LIMIT 1;"
+}
+
+# Record the start of a rip into DIR_FINAL and remember its row in CATALOG_RIP.
+catalog_start () {
+    CATALOG_RIP=$(catalog_sql "
+        INSERT INTO rips (disc, uuid, label, dir, status, started) VALUES (
+            '$DISC_ID', $(sql_quote "$ID_FS_UUID"), $(sql_quote "$ID_FS_LABEL"), $(sql_quote "$DIR_FINAL"), 'ripping',
+            strftime('%s', 'now')
+        );
+        SELECT last_insert_rowid();")
+}
+
+# Record a title from the TITLE_* variables set by parse_title(), with its digest if wrappers.so computed one.
+catalog_title () {
+    local name=${TITLE_PATH##*/} id seconds=NULL digest=NULL
+    if [ -n "$TITLE_DIGEST" ]; then digest=$(sql_quote "$TITLE_DIGEST"); fi
+    for id in "${!DISC_TITLE_NAME[@]}"; do
+        if [ "${DISC_TITLE_NAME[$id]}" == "$name" ]; then seconds=${DISC_TITLE_SECONDS[$id]:-NULL}; fi
+    done
+    catalog_sql "
+        INSERT OR REPLACE INTO titles (rip, name, bytes, seconds, rip_ms, digest, status) VALUES (
+            $CATALOG_RIP, $(sql_quote "$name"), $TITLE_BYTES, $seconds, ${TITLE_SECONDS/./}, $digest, 'done'
+        );"
+}
+
+# Checksum a ripped title and record it. Queued by rip.sh for every title without a digest from wrappers.so.
+catalog_checksum () {
+    local sum
+    sum=$(title_read "$1" sha256sum |cut -d' ' -f1) || return 1
+    if [[ ! $sum =~ ^[0-9a-f]{64}$ ]]; then return 1; fi  # Jobs run without errexit, don't record a bad checksum.
+    catalog_sql "UPDATE titles SET sha256 = '$sum' WHERE rip = $CATALOG_RIP AND name = $(sql_quote "${1##*/}");"
+}
+
+# Record the end of the rip with its final status (done or failed).
+catalog_finish () {
+    catalog_sql "
+        UPDATE rips SET status = '$1', finished = strftime('%s', 'now'),
+            titles = (SELECT COUNT(*) FROM titles WHERE rip = $CATALOG_RIP),
+            bytes = (SELECT COALESCE(SUM(bytes), 0) FROM titles WHERE rip = $CATALOG_RIP)
+        WHERE id = $CATALOG_RIP;"
+}
+
+# Print one metric in node-exporter textfile format. Arguments: type, name, help text, then "labels value" pairs.
+metric () {
+    local type=$1 name=$2 help=$3 labels
+    shift 3
+    echo "# HELP $name $help"
+    echo "# TYPE $name $type"
+    while [ $# -gt 0 ]; do
+        labels=$1
+        echo "$name{$labels} $2"
+        shift 2
+    done
+}
+
+# Record a finished title for the metrics file.
+metrics_title () {
+    echo "$(basename "$TITLE_PATH") $TITLE_BYTES $TITLE_MBPS" >> "$RUN_DIR/metrics_titles"
+}
+
+# Write this rip's metrics to METRICS_DIR/makemkv_SOURCE.prom, replacing the file atomically. The rips and failures
+# counters are carried over from the previous file of the same source. Argument: status (done, failed or skipped).
+metrics_write () {
+    local status=$1 name file key value title bytes rate hook ms
+    local -A counters=() hooks=()
+    local -a args=()
+    name=$(source_name "$SOURCE")
+    file="$METRICS_DIR/makemkv_$name.prom"
+    if [ -r "$file" ]; then
+        while read -r key value; do
+            counters[$key]=$value
+        done < <(grep -E '^makemkv_(rips|failures)_total\{' "$file" || true)
+    fi
+    key="makemkv_rips_total{source=\"$name\",status=\"$status\"}"
+    counters[$key]=$((${counters[$key]:-0} + 1))
+    if [ "$status" == "failed" ]; then
+        key="makemkv_failures_total{source=\"$name\",reason=\"${FAILURE_CODE:-unknown}\"}"
+        counters[$key]=$((${counters[$key]:-0} + 1))
+    fi
+    if [ -s "$RUN_DIR/metrics_hooks" ]; then
+        while read -r hook ms; do hooks[$hook]=$((${hooks[$hook]:-0} + ms)); done < "$RUN_DIR/metrics_hooks"
+    fi
+    mkdir -p "$METRICS_DIR"
+    {
+        metric gauge makemkv_rip_duration_seconds "Seconds the last rip took." "source=\"$name\"" "$SECONDS"
+        metric gauge makemkv_rip_titles "Titles ripped by the last rip." "source=\"$name\"" "${TITLES_DONE:-0}"
+        metric gauge makemkv_rip_bytes "Bytes written by the last rip." "source=\"$name\"" "${TITLES_BYTES:-0}"
+        metric gauge makemkv_rip_write_mbps "Average MB/s makemkvcon wrote MKV files at in the last rip." \
+            "source=\"$name\"" "$(mbps "${TITLES_BYTES:-0}" "${TITLES_USEC:-0}")"
+        if [ -s "$RUN_DIR/metrics_trace.json" ]; then
+            metric gauge makemkv_rip_read_mbps "Average MB/s read from the optical device in the last rip." \
+                "source=\"$name\"" "$(sed -n 's/^  "mbps": \([0-9.]*\),$/\1/p' "$RUN_DIR/metrics_trace.json")"
+        fi
+        if [ -s "$RUN_DIR/metrics_eject" ]; then
+            metric gauge makemkv_eject_seconds "Seconds the last eject took." "source=\"$name\"" \
+                "$(ms_seconds "$(< "$RUN_DIR/metrics_eject")" |tr -d s)"
+        fi
+        if [ -s "$RUN_DIR/metrics_titles" ]; then
+            args=()
+            while read -r title bytes rate; do args+=("source=\"$name\",title=\"$title\"" "$bytes"); done \
+                < "$RUN_DIR/metrics_titles"
+            metric gauge makemkv_title_bytes "Bytes of each title of the last rip." "${args[@]}"
+            args=()
+            while read -r title bytes rate; do args+=("source=\"$name\",title=\"$title\"" "$rate"); done \
+                < "$RUN_DIR/metrics_titles"
+            metric gauge makemkv_title_write_mbps "MB/s each title of the last rip was written at." "${args[@]}"
+        fi
+        if [ ${#hooks[@]} -gt 0 ]; then
+            args=()
+            for hook in "${!hooks[@]}"; do
+                args+=("source=\"$name\",hook=\"$hook\"" "$(ms_seconds "${hooks[$hook]}" |tr -d s)")
+            done
+            metric gauge makemkv_hook_seconds "Seconds spent in each hook script during the last rip." "${args[@]}"
+        fi
+        metric gauge makemkv_rip_timestamp_seconds "When the last rip finished." "source=\"$name\"" "$(date +%s)"
+        echo "# HELP makemkv_rips_total Rips by final status."
+        echo "# TYPE makemkv_rips_total counter"
+        for key in "${!counters[@]}"; do
+            if [[ $key == makemkv_rips_total* ]]; then echo "$key ${counters[$key]}"; fi
+        done |sort
+        echo "# HELP makemkv_failures_total Failed rips by FAILURE_CODE."
+        echo "# TYPE makemkv_failures_total counter"
+        for key in "${!counters[@]}"; do
+            if [[ $key == makemkv_failures_total* ]]; then echo "$key ${counters[$key]}"; fi
+        done |sort
+    } > "$file.tmp"
+    mv -f "$file.tmp" "$file"
+}
+
+# Serve the metrics of every METRICS_DIR/*.prom file over HTTP on METRICS_PORT, samples of the same metric from several
+# files grouped under one HELP/TYPE header. Runs until killed.
+metrics_serve () {
+    cd "$METRICS_DIR" && exec python3 -c '
+import collections, glob, http.server, sys
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        metrics = collections.OrderedDict()
+        for path in sorted(glob.glob("*.prom")):
+            for line in open(path):
+                if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                    metrics.setdefault(line.split()[2], [[], []])[0].append(line)
+                elif line.strip():
+                    metrics.setdefault(line.split("{")[0].split()[0], [[], []])[1].append(line)
+        body = "".join("".join(sorted(set(headers))) + "".join(samples)
+                       for headers, samples in metrics.values()).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, *args):
+        pass
+http.server.HTTPServer(("", int(sys.argv[1])), Handler).serve_forever()
+' "$METRICS_PORT"
+}
+
+# Print scanned title indices, longest first.
+disc_titles () {
+    local id
+    for id in "${!DISC_TITLE_BYTES[@]}"; do echo "${DISC_TITLE_SECONDS[$id]:-0} $id"; done |sort -k1,1rn -k2,2n |cut -d' ' -f2
+}
+
+# Set RIP_TITLES to the given indices, or back to "all" when that's every title (one makemkvcon run instead of many).
+set_rip_titles () {
+    if [ $# -eq ${#DISC_TITLE_BYTES[@]} ]; then RIP_TITLES=(all); else RIP_TITLES=("$@"); fi
+}
+
+# Print the indices RIP_TITLES stands for, longest first.
+rip_titles () {
+    if [ "${RIP_TITLES[*]}" == "all" ]; then disc_titles; else printf '%s\n' "${RIP_TITLES[@]}"; fi
+}
+
+# Apply MAIN_FEATURE, MAX_TITLES and SKIP_DUPLICATES to the disc scan and narrow down RIP_TITLES.
+select_titles () {
+    local id
+    local -i count=0 skipped_bytes=0 skipped_seconds=0
+    local -a chosen=()
+    local -A segments=()
+    while read -r id; do
+        if [ -n "$SKIP_DUPLICATES" ] && [ -n "${DISC_TITLE_SEGMENTS[$id]:-}" ] \
+                && [ -n "${segments[${DISC_TITLE_SEGMENTS[$id]}]:-}" ]; then
+            echo "Skipping title $id (${DISC_TITLE_NAME[$id]:-?}), duplicate of ${segments[${DISC_TITLE_SEGMENTS[$id]}]}."
+        elif [ "$MAX_TITLES" -gt 0 ] && [ "$count" -ge "$MAX_TITLES" ]; then
+            echo "Skipping title $id (${DISC_TITLE_NAME[$id]:-?}), over MAX_TITLES."
+        else
+            if [ -n "${DISC_TITLE_SEGMENTS[$id]:-}" ]; then segments[${DISC_TITLE_SEGMENTS[$id]}]=$id; fi
+            chosen+=($id)
+            count+=1
+            continue
+        fi
+        skipped_bytes+=${DISC_TITLE_BYTES[$id]}
+        skipped_seconds+=${DISC_TITLE_SECONDS[$id]:-0}
+    done < <(disc_titles)
+    declare -gi SELECT_SKIPPED_BYTES=$skipped_bytes
+    echo "Selected titles: ${chosen[*]:-none} of ${#DISC_TITLE_BYTES[@]}, skipping $skipped_bytes bytes" \
+        "($(date -u -d @$skipped_seconds +%T) of video)."
+    if [ $count -eq 0 ]; then
+        echo -e "\nERROR: No titles selected.\n" >&2
+        return 1
+    fi
+    set_rip_titles "${chosen[@]}"
+}
+
+# Set DIR_RESUME to the directory of a failed rip of this disc that has a journal.
+resume_find () {
+    local journal line
+    disc_id
+    for journal in /output/*/.journal; do
+        if [ ! -e "$journal" ] || [ ! -e "${journal%/*}/failed" ]; then continue; fi
+        read -r line < "$journal"
+        if [ "$line" == $'disc\t'"$DISC_ID" ]; then DIR_RESUME=${journal%/*}; fi
+    done
+}
+
+# Record a finished title in the journal so a failed rip can be resumed. The size is the one on disk resume_titles()
+# compares against, TITLE_BYTES counts headers makemkvcon went back and rewrote twice.
+journal_title () {
+    local bytes
+    bytes=$(stat -c %s "$TITLE_PATH")
+    printf 'title\t%s\t%s\t%s\n' "${TITLE_PATH##*/}" "$bytes" "$TITLE_DIGEST" >> "$DIR_FINAL/.journal"
+}
+
+# Remove RIP_TITLES whose journal entry matches the file on disk and delete partial files left by the failed rip.
+resume_titles () {
+    local kind name bytes digest path id
+    local -a missing=()
+    local -A ripped=()
+    while IFS=$'\t' read -r kind name bytes digest; do
+        if [ "$kind" != "title" ]; then continue; fi
+        path=$(title_source "$DIR_FINAL/.rip/$name")
+        if [ -e "$path" ] && [ "$(stat -c %s "$path")" == "$bytes" ]; then ripped[$name]=$bytes; fi
+        if [ -n "${ripped[$name]:-}" ] && [ -n "$digest" ]; then TITLE_DIGESTS[$name]=$digest; fi
+    done < "$DIR_FINAL/.journal"
+    for path in "$DIR_FINAL/.rip/"*; do
+        if [ -e "$path" ] && [ -z "${ripped[${path##*/}]:-}" ]; then sudo -u mkv rm "$path"; fi
+    done
+    for id in $(rip_titles); do
+        if [ -z "${ripped[${DISC_TITLE_NAME[$id]:-?}]:-}" ]; then missing+=($id); fi
+    done
+    echo "Resuming $(basename "$DIR_FINAL"): ${#ripped[@]} titles already ripped, ${#missing[@]} to go."
+    if [ ${#missing[@]} -eq 0 ]; then
+        RIP_TITLES=(none)
+    elif [ ${#ripped[@]} -gt 0 ]; then
+        RIP_TITLES=("${missing[@]}")
+    fi
+}
+
+# Compare RIP_TITLES against free space in /output. Refuse the rip or narrow RIP_TITLES down to what fits.
+space_admit () {
+    local id
+    local -i free total=0 selected=0 reserve=$((SPACE_RESERVE_MB * 1048576))
+    local -a chosen=()
+    declare -gi SPACE_EXPECTED=0
+    free=$(stat -f -c '%a * %S' "$DIR_FINAL")
+    for id in $(rip_titles); do total+=${DISC_TITLE_BYTES[$id]}; done
+    if [ $((total + reserve)) -le "$free" ]; then
+        SPACE_EXPECTED=$total
+        return
+    fi
+    if [ "$SPACE_CHECK" != "fit" ]; then
+        echo -e "\nERROR: Disc needs $total bytes but only $free are free in /output.\n" >&2
+        return 1
+    fi
+
+    # Longest titles first, skipping any that no longer fit.
+    for id in $(rip_titles); do
+        if [ $((selected + DISC_TITLE_BYTES[$id] + reserve)) -gt "$free" ]; then
+            echo "Skipping title $id (${DISC_TITLE_NAME[$id]:-?}, ${DISC_TITLE_BYTES[$id]} bytes), not enough space."
+            continue
+        fi
+        selected+=${DISC_TITLE_BYTES[$id]}
+        chosen+=($id)
+    done
+    if [ ${#chosen[@]} -eq 0 ]; then
+        echo -e "\nERROR: No title fits in the $free bytes free in /output.\n" >&2
+        return 1
+    fi
+    set_rip_titles "${chosen[@]}"
+    SPACE_EXPECTED=$selected
+    echo "Ripping ${#chosen[@]} titles ($selected of $total bytes)."
+}
+
+# Abort the rip once free space where makemkvcon writes can't hold the projected bytes this run still has to rip.
+# Called by rip.sh every second with the time makemkvcon was launched in milliseconds, titles kept from a resumed rip
+# are older. Titles in /scratch waiting to be migrated count as free space, scratch_admit() waits for them.
+space_watch () {
+    local name volume=/output
+    local -i size free writing=0 remaining
+    free=$(stat -f -c '%a * %S' "$DIR_WORKING")
+    while read -r size name; do
+        if [ -z "${SPACE_DONE[$name]:-}" ]; then
+            writing+=size
+        elif [ -n "$DIR_SCRATCH" ]; then
+            free+=size
+        fi
+    done < <(find "$DIR_WORKING" -name '*.mkv' -newermt "@$(($1 / 1000))" -printf '%s %f\n')
+    remaining=$((SPACE_EXPECTED - TITLES_BYTES - writing))
+    if [ -n "$DIR_SCRATCH" ]; then volume=/scratch; fi
+    # Size estimates from the scan are off by a few percent, don't abort over that.
+    if [ "$free" -ge $((remaining * 95 / 100)) ]; then return; fi
+    echo -e "\nERROR: $remaining bytes left to rip but only $free are free in $volume.\n" >&2
+    echo "Terminating MakeMKV due to low disk space." >&2
+    pkill -TERM -s 0 -x makemkvcon || true
+    return 1
+}
+
+# Print the number of CPUs available to the container, honoring the cgroup v2 or v1 CPU quota.
+cpu_count () {
+    local quota=max period=100000
+    local -i cpus
+    cpus=$(nproc)
+    if [ -r /sys/fs/cgroup/cpu.max ]; then
+        read -r quota period < /sys/fs/cgroup/cpu.max
+    elif [ -r /sys/fs/cgroup/cpu/cpu.cfs_quota_us ]; then
+        quota=$(< /sys/fs/cgroup/cpu/cpu.cfs_quota_us)
+        period=$(< /sys/fs/cgroup/cpu/cpu.cfs_period_us)
+    fi
+    if [ "$quota" != "max" ] && [ "$quota" -gt 0 ] && [ $(((quota + period - 1) / period)) -lt "$cpus" ]; then
+        cpus=$(((quota + period - 1) / period))
+    fi
+    echo "$cpus"
+}
+
+# Set the CPU and I/O priority of the current (sub)shell and its future children. Arguments: nice value, class[:level].
+prioritize () {
+    local class=${2%%:*} level=${2#*:}
+    renice "$1" -p "$BASHPID" > /dev/null || debug "Failed to set nice value $1, needs --cap-add SYS_NICE to raise it."
+    if [ "$2" == "$class" ]; then level=; fi
+    ionice -c "$class" ${level:+-n "$level"} -p "$BASHPID" || debug "Failed to set I/O priority $2."
+}
+
+# Put makemkvcon and queued jobs in separate cgroups if cgroup v2 is delegated to the container (writable).
+cgroup_init () {
+    declare -g CGROUP_JOBS=
+    local root=/sys/fs/cgroup majmin pid
+    if [ ! -f "$root/cgroup.controllers" ] || [ ! -w "$root/cgroup.subtree_control" ]; then return 0; fi
+    mkdir -p "$root/rip" "$root/jobs"
+
+    # Controllers can only be enabled for children once no process lives in the parent cgroup.
+    while read -r pid; do echo "$pid" > "$root/rip/cgroup.procs" 2> /dev/null || true; done < "$root/cgroup.procs"
+    echo "+cpu +io" > "$root/cgroup.subtree_control" || return 0
+    echo "$JOB_CPU_WEIGHT" > "$root/jobs/cpu.weight"
+
+    # io.max only accepts whole disks, not partitions or network filesystems (major 0).
+    majmin=$(mountpoint -d /output 2> /dev/null || true)
+    if [ -n "$JOB_IO_MAX" ] && [ -n "$majmin" ] && [ "${majmin%%:*}" != "0" ]; then
+        if [ -e "/sys/dev/block/$majmin/partition" ]; then majmin=$(< "/sys/dev/block/$majmin/../dev"); fi
+        echo "$majmin $JOB_IO_MAX" > "$root/jobs/io.max" || debug "Failed to set io.max for $majmin."
+    fi
+    CGROUP_JOBS="$root/jobs"
+    debug "CGROUPS: makemkvcon in $root/rip, jobs in $CGROUP_JOBS"
+}
+
+# Set up the job queue used for post-title work. Call before queueing anything.
+queue_init () {
+    declare -g DIR_JOBS
+    declare -gi QUEUE_NEXT=0
+    declare -ga QUEUE_PENDING=()
+    declare -gA QUEUE_CMDS=() QUEUE_LANES=() QUEUE_PIDS=() QUEUE_QUEUED=() QUEUE_REPORTED=() QUEUE_SLOTS=()
+    DIR_JOBS=$(mktemp -d /tmp/jobs_XXX)
+    QUEUE_SLOTS[jobs]=$(cpu_count)
+    if [ "$JOBS_MAX" -gt 0 ] && [ "$JOBS_MAX" -lt "${QUEUE_SLOTS[jobs]}" ]; then QUEUE_SLOTS[jobs]=$JOBS_MAX; fi
+    QUEUE_SLOTS[migrate]=1
+    QUEUE_SLOTS[mirror]=$((MIRROR_JOBS > 0 ? MIRROR_JOBS : 1))
+    debug "JOB QUEUE: ${QUEUE_SLOTS[jobs]} slots"
+    cgroup_init
+    if [ "$TRANSCODE" == "true" ] && ! command -v ffmpeg &> /dev/null; then
+        echo -e "\nERROR: TRANSCODE=true but ffmpeg is not installed in this image.\n" >&2
+        return 1
+    fi
+}
+
+# Add a command to the job queue. Jobs start in FIFO order in the background as slots free up.
+# Usage: queue [-l LANE] COMMAND [ARGS...]. Each lane has its own slots, the default lane "jobs" is for hooks.
+queue () {
+    local lane=jobs
+    if [ "$1" == "-l" ]; then lane=$2; shift 2; fi
+    local -i id=$((QUEUE_NEXT += 1))
+    printf -v "QUEUE_CMDS[$id]" '%q ' "$@"
+    QUEUE_LANES[$id]=$lane
+    QUEUE_QUEUED[$id]=$SECONDS
+    QUEUE_PENDING+=($id)
+    debug "JOB $id QUEUED ($lane): $*"
+    queue_pump
+}
+
+# Run one job. Executed in a background subshell, records queue time, run time and exit status.
+queue_run () {
+    trap - ERR  # Failures are reported by queue_wait.
+    local -i id=$1 started=$SECONDS ret=0
+    if [ -n "$CGROUP_JOBS" ]; then echo "$BASHPID" > "$CGROUP_JOBS/cgroup.procs" || true; fi
+    prioritize "$JOB_NICE" "$JOB_IONICE"
+    if [ -n "$TRACE" ]; then trace_event B "job $id: ${QUEUE_CMDS[$id]}"; fi
+    eval "${QUEUE_CMDS[$id]}" || ret=$?
+    if [ -n "$TRACE" ]; then trace_event E "job $id: ${QUEUE_CMDS[$id]}"; fi
+    echo "$((started - ${QUEUE_QUEUED[$id]})) $((SECONDS - started)) $ret" > "$DIR_JOBS/$id"
+    return $ret
+}
+
+# Print the number of running jobs in a lane, or in all lanes if none given.
+queue_running () {
+    local id
+    local -i count=0
+    for id in "${!QUEUE_PIDS[@]}"; do
+        if [ -z "${1:-}" ] || [ "${QUEUE_LANES[$id]}" == "$1" ]; then count+=1; fi
+    done
+    echo "$count"
+}
+
+# Reap finished jobs and start pending ones while their lane has free slots. Never blocks.
+queue_pump () {
+    local id lane
+    local -a pending=()
+    for id in "${!QUEUE_PIDS[@]}"; do
+        if [ -e "$DIR_JOBS/$id" ] || ! kill -0 "${QUEUE_PIDS[$id]}" 2> /dev/null; then
+            wait "${QUEUE_PIDS[$id]}" || true  # Exit status is in the status file.
+            unset "QUEUE_PIDS[$id]"
+        fi
+    done
+    for id in "${QUEUE_PENDING[@]}"; do
+        lane=${QUEUE_LANES[$id]}
+        if [ "$(queue_running "$lane")" -ge "${QUEUE_SLOTS[$lane]:-1}" ]; then
+            pending+=($id)
+            continue
+        fi
+        queue_run "$id" &
+        QUEUE_PIDS[$id]=$!
+        debug "JOB $id STARTED ($lane): ${QUEUE_CMDS[$id]}"
+    done
+    QUEUE_PENDING=("${pending[@]}")
+}
+
+# Print the number of pending and running jobs in a lane, or in all lanes if none given.
+queue_size () {
+    local id
+    local -i count=0
+    for id in "${QUEUE_PENDING[@]}" "${!QUEUE_PIDS[@]}"; do
+        if [ -z "${1:-}" ] || [ "${QUEUE_LANES[$id]}" == "$1" ]; then count+=1; fi
+    done
+    echo "$count"
+}
+
+# Wait for every job in a lane (or all lanes if none given), print queue and run times, and return 1 if any failed.
+queue_wait () {
+    local id queued ran ret
+    local -i failed=0
+    queue_pump
+    while [ "$(queue_size "${1:-}")" -gt 0 ]; do
+        wait -n || true
+        queue_pump
+    done
+    for ((id = 1; id <= QUEUE_NEXT; id++)); do
+        if [ -n "${1:-}" ] && [ "${QUEUE_LANES[$id]}" != "$1" ]; then continue; fi
+        if [ -n "${QUEUE_REPORTED[$id]:-}" ]; then continue; fi
+        if [ -s "$DIR_JOBS/$id" ]; then read -r queued ran ret < "$DIR_JOBS/$id"; else queued=? ran=? ret=killed; fi
+        echo "Job $id queued ${queued}s ran ${ran}s exit $ret: ${QUEUE_CMDS[$id]% }"
+        QUEUE_REPORTED[$id]=$ret
+        if [ "$ret" != "0" ]; then failed+=1; fi
+    done
+    if [ -z "${1:-}" ]; then rm -rf "$DIR_JOBS"; fi
+    if [ "$failed" -gt 0 ]; then
+        echo -e "\nERROR: $failed queued job(s) failed.\n" >&2
+        return 1
+    fi
+}
+
+# Print the current path of a ripped title. It may have been migrated from /scratch or moved by move_back().
+title_source () {
+    local name=${1##*/} path
+    for path in "$1" "$DIR_FINAL/.rip/$name" "$DIR_FINAL/$name"; do
+        if [ -e "$path" ]; then break; fi
+    done
+    echo "$path"
+}
+
+# Run a command with a ripped title open as its stdin, for jobs that read titles. migrate() may remove the title from
+# /scratch between finding and opening it, so it's looked for again if so. Once open it's read to the end even if it's
+# removed. Arguments: title path, command and its arguments.
+title_read () {
+    local fd status
+    { exec {fd}< "$(title_source "$1")"; } 2> /dev/null || exec {fd}< "$(title_source "$1")" || return 1
+    "${@:2}" <&"$fd"
+    status=$?
+    exec {fd}<&-
+    return $status
+}
+
+# Transcode a ripped title with ffmpeg into DIR_FINAL. Queued by rip.sh for every title when TRANSCODE=true.
+transcode () {
+    local name
+    name=$(basename "$1" .mkv)
+    # shellcheck disable=SC2086
+    title_read "$1" sudo -u mkv ffmpeg -nostdin -hide_banner -loglevel error -i /dev/stdin $TRANSCODE_ARGS \
+        -y "$DIR_FINAL/.$name.$TRANSCODE_EXT" || return 1
+    sudo -u mkv mv "$DIR_FINAL/.$name.$TRANSCODE_EXT" "$DIR_FINAL/$name.$TRANSCODE_EXT"
+}
+
+# Copy a finished title from /scratch to DIR_FINAL, then free its scratch space. Queued by rip.sh for every title.
+migrate () {
+    local name=${1##*/}
+    sudo -u mkv /fcopy "$1" "$DIR_FINAL/.$name.part" || return 1  # Jobs run without errexit, keep the scratch copy.
+    sudo -u mkv mv "$DIR_FINAL/.$name.part" "$DIR_FINAL/$name" || return 1
+    sudo -u mkv rm "$1"
+}
+
+# Copy a file of the rip to DIR_MIRROR through the kernel like migrate(). Queued by rip.sh for every title. Each copy
+# is limited to its share of MIRROR_MBPS so all of them together stay under it.
+mirror () {
+    local name=${1##*/}
+    local -i mbps=0
+    if [ "$MIRROR_MBPS" -gt 0 ]; then mbps=$((MIRROR_MBPS / QUEUE_SLOTS[mirror])); fi
+    if [ "$MIRROR_MBPS" -gt 0 ] && [ "$mbps" -lt 1 ]; then mbps=1; fi
+    title_read "$1" sudo -u mkv /fcopy -l "$mbps" /dev/stdin "$DIR_MIRROR/.$name.part" || return 1
+    sudo -u mkv mv "$DIR_MIRROR/.$name.part" "$DIR_MIRROR/$name"
+}
+
+# Make sure DIR_MIRROR matches DIR_FINAL once every queued job is done. Copies what isn't mirrored yet (titles of a
+# resumed rip, transcodes, the manifest) then reads back every mirrored title and compares it with the digest
+# wrappers.so computed while ripping, so DIR_FINAL itself is only read for titles without one.
+mirror_check () {
+    local path name
+    for path in "$DIR_FINAL"/*; do
+        name=${path##*/}
+        if [ ! -f "$path" ] || [ "$name" == "failed" ]; then continue; fi
+        if [ ! -e "$DIR_MIRROR/$name" ] || [ "$(stat -c %s "$path")" != "$(stat -c %s "$DIR_MIRROR/$name")" ]; then
+            mirror "$path"
+        fi
+        if [[ $name == *.mkv ]] && [ -z "${TITLE_DIGESTS[$name]:-}" ]; then
+            TITLE_DIGESTS[$name]=$(title_digest "$path")
+        fi
+    done
+    if [ ${#TITLE_DIGESTS[@]} -eq 0 ]; then return 0; fi
+    for name in "${!TITLE_DIGESTS[@]}"; do
+        printf '%s\t%s\t%s\n' "$name" "$(stat -c %s "$DIR_FINAL/$name")" "${TITLE_DIGESTS[$name]}"
+    done |sudo -u mkv tee "$DIR_MIRROR/.manifest" > /dev/null
+    if ! manifest_verify "$DIR_MIRROR/.manifest"; then
+        echo -e "\nERROR: $DIR_MIRROR does not match $DIR_FINAL.\n" >&2
+        return 1
+    fi
+    sudo -u mkv rm "$DIR_MIRROR/.manifest"
+}
+
+# Pause makemkvcon while /scratch is nearly full and titles are still being migrated, resume once space frees up.
+scratch_admit () {
+    local -i free_mb
+    free_mb=$(($(stat -f -c '%a * %S' "$DIR_SCRATCH") / 1048576))
+    if [ -z "$SCRATCH_PAUSED" ] && [ "$free_mb" -lt "$SCRATCH_MIN_FREE_MB" ] && [ "$(queue_size migrate)" -gt 0 ]; then
+        echo "Pausing makemkvcon, only $free_mb MiB free in /scratch. Waiting for titles to migrate..."
+        pkill -STOP -s 0 -x makemkvcon || true
+        SCRATCH_PAUSED=true
+    elif [ -n "$SCRATCH_PAUSED" ]; then
+        if [ "$free_mb" -ge $((SCRATCH_MIN_FREE_MB * 2)) ] || [ "$(queue_size migrate)" -eq 0 ]; then
+            echo "Resuming makemkvcon, $free_mb MiB free in /scratch."
+            pkill -CONT -s 0 -x makemkvcon || true
+            SCRATCH_PAUSED=
+        fi
+    fi
 }
 
 # Move media from incoming directory to movie directory.
 move_back () {
+    if [ -n "$DIR_SCRATCH" ]; then
+        SCRATCH_PAUSED=  # makemkvcon has exited.
+        queue_wait migrate
+        if compgen -G "$DIR_WORKING/*" > /dev/null; then sudo -u mkv mv "$DIR_WORKING/"* "$DIR_FINAL/"; fi
+        rmdir "$DIR_WORKING"
+        if [ -d "$DIR_FINAL/.rip" ]; then  # Titles of a resumed rip.
+            if compgen -G "$DIR_FINAL/.rip/*" > /dev/null; then sudo -u mkv mv "$DIR_FINAL/.rip/"* "$DIR_FINAL/"; fi
+            sudo -u mkv rmdir "$DIR_FINAL/.rip"
+        fi
+        return
+    fi
     sudo -u mkv mv "$DIR_WORKING/"* "$DIR_FINAL/"
     sudo -u mkv rmdir "$DIR_WORKING"
 }
+
+# Write DIR_FINAL/manifest with the name, size and digest of every title checksummed by wrappers.so, one per line.
+manifest_write () {
+    local name
+    for name in "${!TITLE_DIGESTS[@]}"; do
+        if [ -e "$DIR_FINAL/$name" ]; then
+            printf '%s\t%s\t%s\n' "$name" "$(stat -c %s "$DIR_FINAL/$name")" "${TITLE_DIGESTS[$name]}"
+        fi
+    done |sort |sudo -u mkv tee "$DIR_FINAL/manifest" > /dev/null
+}
+
+# Print the digest wrappers.so computes while writing a file: the SHA-256 of the SHA-256 of every 64 MiB chunk.
+title_digest () {
+    local -i size chunk
+    size=$(stat -c %s "$1")
+    for ((chunk = 0; chunk * 67108864 < size; chunk++)); do
+        dd if="$1" bs=1M skip=$((chunk * 64)) count=64 status=none |sha256sum |cut -c1-64
+    done |sha256sum |cut -c1-64
+}
+
+# Print OK or FAILED for one title of a manifest. Arguments: path, size and digest. Returns 1 if the title failed.
+manifest_check () {
+    local digest
+    if [ ! -f "$1" ] || [ "$(stat -c %s "$1")" != "$2" ]; then
+        echo "FAILED $1: missing or not $2 bytes"
+        return 1
+    fi
+    digest=$(title_digest "$1")
+    if [ "$digest" != "$3" ]; then
+        echo "FAILED $1: digest $digest"
+        return 1
+    fi
+    echo "OK $1"
+}
+
+# Check titles against their manifests, as many titles at once as there are CPUs. Arguments: manifests, defaults to
+# every /output/*/manifest. Returns 1 if any title failed.
+manifest_verify () {
+    local manifest name size digest
+    local -i jobs titles=0 running=0 failed=0
+    local -a manifests=("$@")
+    if [ ${#manifests[@]} -eq 0 ]; then manifests=(/output/*/manifest); fi
+    jobs=$(cpu_count)
+    for manifest in "${manifests[@]}"; do
+        if [ ! -r "$manifest" ]; then
+            echo "FAILED $manifest: no manifest"
+            failed+=1
+            continue
+        fi
+        while IFS=$'\t' read -r name size digest; do
+            if [ "$running" -ge "$jobs" ]; then
+                wait -n || failed+=1
+                running+=-1
+            fi
+            manifest_check "${manifest%/*}/$name" "$size" "$digest" &
+            running+=1 titles+=1
+        done < "$manifest"
+    done
+    while [ "$running" -gt 0 ]; do
+        wait -n || failed+=1
+        running+=-1
+    done
+    echo "Verified $titles titles after $(date -u -d @$SECONDS +%T): $failed failed."
+    [ "$failed" -eq 0 ]
+}
+
+# Write titles done and bytes written so far to STATUS_FILE for the supervisor's status view. Called every second.
+rip_status () {
+    local -i written
+    written=$(find "$DIR_FINAL" ${DIR_SCRATCH:+"$DIR_SCRATCH"} -name '*.mkv*' -printf '%s\n' |awk '{s += $1} END {print s + 0}')
+    echo "$TITLES_DONE $written" > "$STATUS_FILE.tmp" && mv "$STATUS_FILE.tmp" "$STATUS_FILE"
+}
+
+# Print a short name for a source: the device or file name.
+source_name () {
+    local name=${1#*:}
+    echo "${name##*/}"
+}
+
+# Print optical devices: the arguments, else DEVICES, else every /dev/sr* block device.
+optical_devices () {
+    local device
+    local -a devices=("$@")
+    if [ ${#devices[@]} -eq 0 ]; then devices=($DEVICES); fi
+    if [ ${#devices[@]} -eq 0 ]; then
+        for device in /dev/sr[0-9]*; do
+            if [ -b "$device" ]; then devices+=("$device"); fi
+        done
+    fi
+    if [ ${#devices[@]} -gt 0 ]; then printf '%s\n' "${devices[@]}"; fi
+}
+
+# Start rip.sh for one source in its own session (so it only ever kills its own makemkvcon) and run directory.
+# Sources starting with dev: rip that optical device, others are passed on as SOURCE. Sets SUPERVISE_RUN.
+supervise_start () {
+    local source=$1 name run devname=
+    local -a env=(ID_FS_LABEL= ID_FS_UUID= SOURCE="$source")
+    name=$(source_name "$source")
+    run=$(mktemp -d /tmp/supervise_XXX)
+    chmod 0711 "$run"  # makemkvcon runs as mkv and has to reach the named pipe in there.
+    echo "$source" > "$run/source"
+    if [ "${source%%:*}" == "dev" ]; then env=(ID_FS_LABEL= ID_FS_UUID= DEVNAME="${source#dev:}" SOURCE=); fi
+    env "${env[@]}" RUN_DIR="$run" STATUS_FILE="$run/status" \
+        setsid -w bash -c 'echo $$ > "$RUN_DIR/pid"; exec /rip.sh' < /dev/null 2>&1 \
+        |tee "$run/log" \
+        |sed -u "s|^|[$name] |" &
+    SUPERVISE_PIDS[$run]=$!
+    SUPERVISE_RUN=$run
+}
+
+# Print one line with every running source's titles done, bytes written and MB/s since the last status line.
+supervise_status () {
+    local run line=
+    local -i titles written last
+    for run in "${!SUPERVISE_PIDS[@]}"; do
+        titles=0 written=0 last=${SUPERVISE_WRITTEN[$run]:-0}
+        if [ -s "$run/status" ]; then read -r titles written < "$run/status"; fi
+        line+=" | $(source_name "$(< "$run/source")"): $titles titles $((written / 1000000)) MB"
+        line+=" $(mbps $((written > last ? written - last : 0)) $((STATUS_INTERVAL * 1000000))) MB/s"
+        SUPERVISE_WRITTEN[$run]=$written
+    done
+    echo "Status after $(date -u -d @$SECONDS +%T)${line:- | idle}"
+}
+
+# Print OK or FAILED with the result of a finished source and remove its run directory. Adds its titles and bytes to
+# SUPERVISE_TITLES and SUPERVISE_BYTES. Returns 1 if the source failed.
+supervise_report () {
+    local run=$1 line source
+    source=$(< "$run/source")
+    line=$(grep -a '^Done after ' "$run/log" |tail -1 || true)
+    rm -rf "$run"
+    if [[ $line =~ \(([0-9]+)\ titles,\ ([0-9]+)\ bytes ]]; then
+        SUPERVISE_TITLES+=${BASH_REMATCH[1]}
+        SUPERVISE_BYTES+=${BASH_REMATCH[2]}
+        echo "OK $source: ${line#Done after }"
+        return 0
+    fi
+    echo "FAILED $source"
+    return 1
+}
+
+# Stop every rip.sh started by this supervisor, other supervisors in the same container keep running.
+supervise_term () {
+    local run
+    for run in "${!SUPERVISE_PIDS[@]}"; do
+        if [ -e "$run/pid" ]; then kill -TERM -- "-$(< "$run/pid")" 2> /dev/null || true; fi
+    done
+    wait
+    exit 143
+}
+
+# Run rip.sh for every source, at most JOBS at once, print a status line every STATUS_INTERVAL seconds and a report at
+# the end. Arguments: jobs, sources... Returns 1 if any source failed. A failed source never affects the others.
+supervise () {
+    local -i jobs=$1 failed=0 next=0 started=$SECONDS status_at=$((SECONDS + STATUS_INTERVAL))
+    local run
+    shift
+    declare -gA SUPERVISE_PIDS=() SUPERVISE_WRITTEN=()
+    declare -gi SUPERVISE_TITLES=0 SUPERVISE_BYTES=0
+    local -a pending=("$@") finished=()
+    trap supervise_term TERM
+    while [ "$next" -lt ${#pending[@]} ] || [ ${#SUPERVISE_PIDS[@]} -gt 0 ]; do
+        for run in "${!SUPERVISE_PIDS[@]}"; do
+            if ! kill -0 "${SUPERVISE_PIDS[$run]}" 2> /dev/null; then
+                wait "${SUPERVISE_PIDS[$run]}" || true  # Failures are read from the log below.
+                unset "SUPERVISE_PIDS[$run]"
+                finished+=("$run")
+            fi
+        done
+        while [ "$next" -lt ${#pending[@]} ] && [ ${#SUPERVISE_PIDS[@]} -lt "$jobs" ]; do
+            supervise_start "${pending[$next]}"
+            next+=1
+        done
+        sleep 1
+        if [ "$STATUS_INTERVAL" -gt 0 ] && [ "$SECONDS" -ge "$status_at" ]; then
+            supervise_status
+            status_at=$((SECONDS + STATUS_INTERVAL))
+        fi
+    done
+    trap - TERM
+
+    # Report.
+    for run in "${finished[@]}"; do
+        supervise_report "$run" || failed+=1
+    done
+    echo "Finished $((${#finished[@]} - failed)) of ${#finished[@]} sources after $(date -u -d @$((SECONDS - started)) +%T):" \
+        "$SUPERVISE_TITLES titles, $SUPERVISE_BYTES bytes at" \
+        "$(mbps $SUPERVISE_BYTES $(((SECONDS - started) * 1000000))) MB/s"
+    if [ "$failed" -gt 0 ]; then
+        echo -e "\nERROR: $failed source(s) failed.\n" >&2
+        return 1
+    fi
+}
@@ -0,0 +1,65 @@
+#!/bin/bash
+
+# Convert a batch of ISO images and BDMV/VIDEO_TS folders with rip.sh, several at a time.
+# https://github.com/Robpol86/makemkv/blob/master/bin/ingest.sh
+# Save as (chmod +x): /ingest.sh
+# Usage: ingest.sh [SOURCE...] where SOURCE is iso:PATH, file:PATH or a plain path. Defaults to everything in /input.
+
+set -E  # Call ERR traps when using -e.
+set -e  # Exit script if a command fails.
+set -u  # Treat unset variables as errors and exit immediately.
+set -o pipefail  # Exit script if pipes fail instead of just the last program.
+
+# Source function library.
+source /env.sh
+
+# Print the number of sources to convert at once, limited by CPUs and by memory (INGEST_MEM_MB per makemkvcon).
+ingest_jobs () {
+    local limit=max
+    local -i jobs
+    jobs=$(cpu_count)
+    if [ -r /sys/fs/cgroup/memory.max ]; then
+        limit=$(< /sys/fs/cgroup/memory.max)
+    elif [ -r /sys/fs/cgroup/memory/memory.limit_in_bytes ]; then
+        limit=$(< /sys/fs/cgroup/memory/memory.limit_in_bytes)
+    fi
+    if [ "$limit" != "max" ] && [ $((limit / 1048576 / INGEST_MEM_MB)) -lt "$jobs" ]; then
+        jobs=$((limit / 1048576 / INGEST_MEM_MB))
+    fi
+    if [ "$INGEST_JOBS" -gt 0 ]; then jobs=$INGEST_JOBS; fi
+    if [ "$jobs" -lt 1 ]; then jobs=1; fi
+    echo "$jobs"
+}
+
+# Print sources in /input: ISO images and folders with a BDMV or VIDEO_TS directory.
+ingest_sources () {
+    local path
+    for path in /input/*; do
+        if [ -f "$path" ] && [[ ${path,,} == *.iso ]]; then
+            echo "iso:$path"
+        elif [ -d "$path/BDMV" ] || [ -d "$path/VIDEO_TS" ]; then
+            echo "file:$path"
+        fi
+    done
+}
+
+# Gather sources.
+declare -a sources=("$@")
+if [ ${#sources[@]} -eq 0 ]; then sources=($(ingest_sources)); fi
+if [ ${#sources[@]} -eq 0 ]; then
+    echo -e "\nERROR: No sources given and no ISO images or BDMV/VIDEO_TS folders in /input.\n" >&2
+    exit 1
+fi
+for i in "${!sources[@]}"; do
+    case ${sources[$i]} in
+        dev:*|iso:*|file:*) ;;
+        *.iso|*.ISO) sources[$i]="iso:${sources[$i]}" ;;
+        *) sources[$i]="file:${sources[$i]}" ;;
+    esac
+done
+
+# Convert. The mkv user and sudo are set up once here instead of by every rip.sh at the same time.
+setup
+export SETUP_DONE=true
+echo "Ingesting ${#sources[@]} sources, $(ingest_jobs) at a time..."
+supervise "$(ingest_jobs)" "${sources[@]}"
@@ -10,8 +10,20 @@ set -u  # Treat unset variables as errors and exit immediately.
 set -o pipefail  # Exit script if pipes fail instead of just the last program.
 
 # Source function library.
+started_ms=$(date +%s%3N)
 source /env.sh
+
+# Check titles against manifests written with CHECKSUM=true instead of ripping. Usage: rip.sh verify [MANIFEST...]
+if [ "${1:-}" == "verify" ]; then
+    shift
+    manifest_verify "$@"
+    exit 0
+fi
+
+rm -f "$RUN_DIR/failure" "$RUN_DIR"/metrics_* "$RUN_DIR/trace_events"  # Left over from a previous rip.
 hook post-env
+env_ms=$(now)
+if [ -n "$TRACE" ]; then trace_event X env $(((env_ms - started_ms) * 1000)); fi
 
 # Print environment.
 if [ "$DEBUG" == "true" ]; then
@@ -20,52 +32,160 @@ if [ "$DEBUG" == "true" ]; then
 fi
 
 # Verify the device.
-if [ -z "$DEVNAME" ]; then
+if [ "${SOURCE%%:*}" != "dev" ]; then
+    if [ ! -e "${SOURCE#*:}" ]; then
+        echo -e "\nERROR: Source ${SOURCE#*:} does not exist.\n" >&2
+        exit 1
+    fi
+elif [ -z "$DEVNAME" ]; then
     echo -e "\nERROR: Unable to find optical device.\n" >&2
     exit 1
-fi
-if [ ! -b "$DEVNAME" ]; then
+elif [ ! -b "$DEVNAME" ]; then
     echo -e "\nERROR: Device $DEVNAME not a block-special file.\n" >&2
     exit 1
 fi
 
-# Setup trap for hooks and FAILED_EJECT.
-trap "hook pre-on-err; on_err; hook post-on-err; wait" ERR
+if [ "$RIP_MODE" != "mkv" ] && [ "$RIP_MODE" != "backup" ]; then
+    echo -e "\nERROR: Invalid RIP_MODE $RIP_MODE, must be mkv or backup.\n" >&2
+    exit 1
+fi
+
+if [ -n "$MIRROR_DIR" ] && [ ! -d "$MIRROR_DIR" ]; then
+    echo -e "\nERROR: MIRROR_DIR $MIRROR_DIR is not a directory.\n" >&2
+    exit 1
+fi
+
+# Setup trap for hooks and FAILED_EJECT. Also fail cleanly when stopped (docker stop or ingest.sh being stopped).
+# FAILURE_CODE tells hooks why: a code from FAILURE_RULES, "terminated" or "unknown".
+trap "failure_code; hook pre-on-err; on_err; hook post-on-err; wait" ERR
+trap "echo -e '\nERROR: Terminated.\n' >&2; FAILURE_CODE=terminated; hook pre-on-err; on_err; hook post-on-err; exit 143" \
+    TERM
+
+# Skip discs that were already ripped.
+if [ -n "$CATALOG" ]; then
+    catalog_init
+    ripped=$(catalog_lookup)
+    if [ -n "$ripped" ] && [ -z "$FORCE" ]; then
+        echo "Disc already ripped to $ripped, set FORCE=true to rip it again."
+        if [ "$NO_EJECT" != "true" ]; then eject_disc; fi
+        if [ -n "$METRICS_DIR" ]; then metrics_write skipped; fi
+        exit 0
+    fi
+fi
+
+# Pick up where a failed rip of the same disc left off.
+if [ -z "$NO_RESUME$FORCE" ]; then span resume_find resume_find; fi
 
 # Prepare the environment before ripping.
 hook pre-prepare
-prepare
+span prepare prepare
+queue_init
+if [ -n "$CATALOG" ]; then span catalog_start catalog_start; fi
 hook post-prepare
 
-# Rip media.
+# Pick titles and make sure they fit before spending time on the disc.
+if [ "$MAX_TITLES" -gt 0 ] || [ -n "$DIR_RESUME$SKIP_DUPLICATES$SPACE_CHECK$CATALOG" ] || [ "$(rip_jobs)" -gt 1 ]; then
+    echo "Scanning disc..."
+    span disc_scan disc_scan
+    span select_titles select_titles
+    if [ -n "$DIR_RESUME" ]; then resume_titles; fi
+    if [ -n "$SPACE_CHECK" ]; then span space_admit space_admit; fi
+fi
+
+# Rip media. The named pipe is ready before makemkvcon starts, wrappers.so sends an init record once it's attached.
 echo "Ripping..."
 hook pre-rip
+prepared_ms=$(now)
+rm -f "$RUN_DIR/titles_done" && mkfifo -m 0600 "$_" && chown mkv:mkv "$_"
+exec 3<> "$RUN_DIR/titles_done"  # Read-write so every makemkvcon run can come and go without an EOF.
+launched_ms=$(now)
+if [ -n "$TRACE" ]; then trace_event B makemkvcon; fi
 run_makemkvcon &
 makemkvcon_pid=$!
-timeout 5 bash -c "until [ -e /tmp/titles_done ]; do sleep 0.1; done"
-export TITLE_PATH
-while read -rd $'\0' TITLE_PATH; do
-    if [ "$TITLE_PATH" == "fini" ]; then
+export TITLE_PATH TITLE_BYTES TITLE_DIGEST TITLE_MBPS TITLE_SECONDS TITLE_WRITES TITLE_WRITE_HIST
+declare -i TITLES_DONE=0 TITLES_BYTES=0 TITLES_USEC=0
+partial= ready= SCRATCH_PAUSED=
+while true; do
+    # Time out every second to start queued jobs as slots free up.
+    record= ret=0
+    read -t 1 -rd $'\0' record <&3 || ret=$?
+    if [ "$ret" -gt 128 ]; then
+        partial+=$record
+        queue_pump
+        if [ -n "$DIR_SCRATCH" ]; then scratch_admit; fi
+        if [ -n "$SPACE_CHECK" ]; then space_watch "$launched_ms"; fi
+        if [ -n "$STATUS_FILE" ]; then rip_status; fi
+        if ! kill -0 ${makemkvcon_pid} 2> /dev/null; then break; fi
+        continue
+    elif [ "$ret" -ne 0 ]; then
         break
-    elif [ "$TITLE_PATH" == "init" ]; then
+    fi
+    record=$partial$record partial=
+    if [[ $record == init$'\t'* ]]; then
+        if [ -z "$ready" ] && [ "$DEBUG" == "true" ]; then
+            startup_times "$record" "$started_ms" "$env_ms" "$prepared_ms" "$launched_ms"
+        fi
+        ready=true
+    elif [ "$record" == "fini" ]; then
         continue
+    elif [[ $record == first_read$'\t'* ]]; then
+        first_read "$record" "$started_ms"
     else
+        parse_title "$record"
+        echo "Title done: $(basename "$TITLE_PATH") $TITLE_BYTES bytes in ${TITLE_SECONDS}s ($TITLE_MBPS MB/s)"
+        if [ -n "$TRACE" ]; then
+            trace_event X "$(basename "$TITLE_PATH")" $((10#${TITLE_SECONDS/./} * 1000)) "$makemkvcon_pid"
+        fi
+        if [ -n "$TITLE_DIGEST" ]; then TITLE_DIGESTS[$(basename "$TITLE_PATH")]=$TITLE_DIGEST; fi
+        if [ -n "$SPACE_CHECK" ]; then SPACE_DONE[$(basename "$TITLE_PATH")]=$TITLE_BYTES; fi
+        if [ -z "$NO_RESUME" ]; then journal_title; fi
+        if [ -n "$METRICS_DIR" ]; then metrics_title; fi
+        if [ -n "$CATALOG" ]; then catalog_title; fi
+        if [ -n "$CATALOG" ] && [ -z "$TITLE_DIGEST" ]; then queue catalog_checksum "$TITLE_PATH"; fi
         hook post-title
+        if [ "$TRANSCODE" == "true" ]; then queue transcode "$TITLE_PATH"; fi
+        if [ -n "$MIRROR_DIR" ]; then queue -l mirror mirror "$TITLE_PATH"; fi
+        if [ -n "$DIR_SCRATCH" ]; then queue -l migrate migrate "$TITLE_PATH" && scratch_admit; fi
     fi
-done < /tmp/titles_done
-unset TITLE_PATH
+done
+exec 3<&-
+if [ -z "$ready" ] && [ "${RIP_TITLES[*]}" != "none" ]; then
+    echo "WARNING: wrappers.so never attached to makemkvcon, post-title hooks did not run." >&2
+fi
+unset TITLE_PATH TITLE_BYTES TITLE_DIGEST TITLE_MBPS TITLE_SECONDS TITLE_WRITES TITLE_WRITE_HIST
 wait ${makemkvcon_pid}
+ripped_ms=$(now)
+if [ -n "$TRACE" ]; then trace_event E makemkvcon; fi
 hook post-rip
-move_back
+span move_back move_back
+rm -f "$DIR_FINAL/.journal"
+if [ -n "$CHECKSUM" ] && [ ${#TITLE_DIGESTS[@]} -gt 0 ]; then manifest_write; fi
 
-# Eject.
-if [ "$NO_EJECT" != "true" ]; then
+# Eject. In backup mode the disc was ejected as soon as the backup was done.
+if [ "$NO_EJECT" != "true" ] && [ "$RIP_MODE" != "backup" ]; then
     hook pre-success-eject
     echo "Ejecting..."
-    eject ${DEBUG:+--verbose} "$DEVNAME"
+    span eject eject_disc
     hook post-success-eject
 fi
 
 hook end
-wait
-echo Done after $(date -u -d @$SECONDS +%T) with $(basename "$DIR_FINAL")
+span queue_wait queue_wait
+span wait wait
+if [ -n "$MIRROR_DIR" ]; then span mirror_check mirror_check; fi
+if [ -n "$CATALOG" ]; then catalog_finish done; fi
+if [ -n "$METRICS_DIR" ]; then metrics_write done; fi
+if [ -n "$TRACE" ]; then trace_write; fi
+echo Done after $(date -u -d @$SECONDS +%T) with $(basename "$DIR_FINAL") \
+    "($TITLES_DONE titles, $TITLES_BYTES bytes at $(mbps $TITLES_BYTES $TITLES_USEC) MB/s)"
+if [ "${SELECT_SKIPPED_BYTES:-0}" -gt 0 ] && [ "$TITLES_BYTES" -gt 0 ]; then
+    echo "Skipping titles saved about" \
+        "$(date -u -d @$((SELECT_SKIPPED_BYTES / (TITLES_BYTES * 1000000 / TITLES_USEC + 1))) +%T) of ripping."
+fi
+if [ "$(rip_jobs)" -gt 1 ] && [ "$TITLES_DONE" -gt 1 ]; then
+    wall_ms=$((ripped_ms > launched_ms ? ripped_ms - launched_ms : 1))
+    concurrency=$((TITLES_USEC / (wall_ms * 10)))  # Hundredths.
+    echo "Ripping with up to $(rip_jobs) makemkvcon processes took $(ms_seconds $wall_ms)" \
+        "for $(ms_seconds $((TITLES_USEC / 1000))) of title ripping time" \
+        "(concurrency $((concurrency / 100)).$((concurrency / 10 % 10))$((concurrency % 10)))."
+fi
@@ -0,0 +1,163 @@
+/*
+    Micro-benchmarks for wrappers.so.
+
+    open:
+    Measures overhead per open(3)/close(3) pair for three kinds of descriptors makemkvcon closes during a rip:
+        untracked   Regular files outside WRAPPERS_PREFIX (disc files, settings, etc).
+        tracked     Empty MKV files inside WRAPPERS_PREFIX (table insert and lookup, no named pipe write).
+        pipe        Descriptors never seen by open(3) (sockets, pipes).
+
+    write:
+    Writes an MKV file in 1 MiB write(3) calls like makemkvcon does, then calls sync(2) like makemkvcon_output in env.sh
+    does before stopping makemkvcon when a failure rule fires. Prints write time, sync time and the peak of Dirty +
+    Writeback from /proc/meminfo sampled every 10 ms. Compare runs with WRAPPERS_FALLOCATE_MB, WRAPPERS_WRITEBACK_MB
+    (sync_file_range(2) while writing, leaving less for the final sync) and WRAPPERS_DROP_CACHE set.
+
+    Build:
+    gcc -O2 -o bench bench.c -pthread
+
+    Usage:
+    ./bench open DIR [ITERATIONS]
+    ./bench write DIR [MIB]
+    LD_PRELOAD=./wrappers.so WRAPPERS_PREFIX=DIR/ ./bench ...
+ */
+
+#define _GNU_SOURCE
+
+#include <fcntl.h>
+#include <pthread.h>
+#include <stdbool.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+
+
+static volatile bool sampling;
+static long peak_dirty_kb;
+
+
+// Return monotonic time in nanoseconds.
+static long long now_ns(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000000000LL + ts.tv_nsec;
+}
+
+
+// Time ITERATIONS open/close pairs of path and print nanoseconds per pair.
+static void bench_open(const char *name, const char *path, long iterations) {
+    long long start = now_ns();
+    for (long i = 0; i < iterations; i++) {
+        int fd = open(path, O_WRONLY | O_CREAT, 0644);
+        if (fd < 0) {
+            perror(path);
+            exit(1);
+        }
+        close(fd);
+    }
+    printf("%-10s %10.1f ns/pair\n", name, (double) (now_ns() - start) / iterations);
+    unlink(path);
+}
+
+
+// Time ITERATIONS pipe/close pairs (two descriptors per pipe) and print nanoseconds per pair.
+static void bench_pipe(long iterations) {
+    int fds[2];
+    long long start = now_ns();
+    for (long i = 0; i < iterations; i++) {
+        if (pipe(fds) == -1) {
+            perror("pipe");
+            exit(1);
+        }
+        close(fds[0]);
+        close(fds[1]);
+    }
+    printf("%-10s %10.1f ns/pair\n", "pipe", (double) (now_ns() - start) / iterations);
+}
+
+
+// Return Dirty + Writeback from /proc/meminfo in KiB.
+static long dirty_kb(void) {
+    FILE *file = fopen("/proc/meminfo", "r");
+    if (!file) return 0;
+    char line[256];
+    long total = 0, value;
+    while (fgets(line, sizeof line, file)) {
+        if (sscanf(line, "Dirty: %ld kB", &value) == 1 || sscanf(line, "Writeback: %ld kB", &value) == 1) {
+            total += value;
+        }
+    }
+    fclose(file);
+    return total;
+}
+
+
+// Sampler thread. Tracks peak dirty page cache until sampling is cleared.
+static void *sample(void *arg) {
+    (void) arg;
+    while (sampling) {
+        long kb = dirty_kb();
+        if (kb > peak_dirty_kb) peak_dirty_kb = kb;
+        usleep(10000);
+    }
+    return NULL;
+}
+
+
+// Write mib MiB to path, sync, and print timings and peak dirty memory.
+static void bench_write(const char *path, long mib) {
+    static char buf[1048576];
+    memset(buf, 0xAB, sizeof buf);
+    pthread_t thread;
+    sampling = true;
+    pthread_create(&thread, NULL, sample, NULL);
+
+    long long start = now_ns();
+    int fd = open(path, O_WRONLY | O_CREAT | O_TRUNC, 0644);
+    if (fd < 0) {
+        perror(path);
+        exit(1);
+    }
+    for (long i = 0; i < mib; i++) {
+        if (write(fd, buf, sizeof buf) != sizeof buf) {
+            perror("write");
+            exit(1);
+        }
+    }
+    close(fd);
+    long long written = now_ns();
+    sync();
+    long long synced = now_ns();
+
+    sampling = false;
+    pthread_join(thread, NULL);
+    printf(
+        "write %8.3f s  sync %8.3f s  peak dirty %8ld KiB\n",
+        (written - start) / 1e9, (synced - written) / 1e9, peak_dirty_kb
+    );
+    unlink(path);
+}
+
+
+int main(int argc, char *argv[]) {
+    if (argc < 3 || (strcmp(argv[1], "open") && strcmp(argv[1], "write"))) {
+        fprintf(stderr, "Usage: %s open DIR [ITERATIONS]\n       %s write DIR [MIB]\n", argv[0], argv[0]);
+        return 2;
+    }
+
+    char untracked[4096], tracked[4096];
+    snprintf(untracked, sizeof untracked, "%s/bench.txt", argv[2]);
+    snprintf(tracked, sizeof tracked, "%s/bench.mkv", argv[2]);
+
+    if (!strcmp(argv[1], "write")) {
+        bench_write(tracked, argc > 3 ? atol(argv[3]) : 1024);
+        return 0;
+    }
+    long iterations = argc > 3 ? atol(argv[3]) : 100000;
+    bench_open("untracked", untracked, iterations);
+    bench_open("tracked", tracked, iterations);
+    bench_pipe(iterations);
+    return 0;
+}
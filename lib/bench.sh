@@ -0,0 +1,48 @@
+#!/bin/bash
+
+# Benchmark wrappers.so with and without LD_PRELOAD.
+# Usage: ./bench.sh [ITERATIONS [MIB [DIR]]]
+#   ITERATIONS  open/close pairs per case (default 100000).
+#   MIB         Size of the MKV file written by the write benchmark (default 1024).
+#   DIR         Where to write files, ideally on the same filesystem as /output (default a temporary directory).
+
+set -e  # Exit script if a command fails.
+set -u  # Treat unset variables as errors and exit immediately.
+set -o pipefail  # Exit script if pipes fail instead of just the last program.
+
+HERE="$(cd "$(dirname "$0")" && pwd)"
+ITERATIONS=${1:-100000}
+MIB=${2:-1024}
+TMP=$(mktemp -d)
+DIR=${3:-$TMP}
+trap 'rm -rf "$TMP"' EXIT
+
+# Build.
+gcc -O2 -o "$TMP/bench" "$HERE/bench.c" -pthread
+gcc -o "$TMP/wrappers.so" "$HERE/wrappers.c" -fPIC -shared -pthread
+
+# Run the benchmark with wrappers.so preloaded. Extra arguments are environment variables. The named pipe exists and has
+# a reader before the benchmark starts, like in rip.sh, since the constructor blocks until then.
+preloaded () {
+    local -a args=("${@:$#-2}")
+    mkfifo "$TMP/titles_done"
+    cat "$TMP/titles_done" > /dev/null &
+    env "${@:1:$#-3}" LD_PRELOAD="$TMP/wrappers.so" WRAPPERS_FIFO="$TMP/titles_done" WRAPPERS_PREFIX="$DIR/" \
+        "$TMP/bench" "${args[@]}" 2> >(grep -v '^wrappers.so: ' >&2)
+    wait
+    rm -f "$TMP/titles_done"
+}
+
+echo "open/close without LD_PRELOAD:"
+"$TMP/bench" open "$DIR" "$ITERATIONS"
+echo "open/close with LD_PRELOAD:"
+preloaded open "$DIR" "$ITERATIONS"
+
+echo "$MIB MiB write without LD_PRELOAD:"
+"$TMP/bench" write "$DIR" "$MIB"
+for options in "" WRAPPERS_FALLOCATE_MB=256 WRAPPERS_WRITEBACK_MB=64 WRAPPERS_DROP_CACHE=true \
+        "WRAPPERS_FALLOCATE_MB=256 WRAPPERS_WRITEBACK_MB=64 WRAPPERS_DROP_CACHE=true"; do
+    echo "$MIB MiB write with LD_PRELOAD ${options:-(defaults)}:"
+    # shellcheck disable=SC2086
+    preloaded $options write "$DIR" "$MIB"
+done
@@ -0,0 +1,153 @@
+/*
+ * Copy a finished title from the scratch volume to /output as cheaply as the kernel allows.
+ *
+ * Tries a reflink (FICLONE) first which is instant on btrfs/XFS when both paths share a filesystem, then
+ * copy_file_range() which stays in the kernel (and may be offloaded by NFS/CIFS servers), then falls back to
+ * sendfile() which still avoids copying through user space. The destination is fsynced before exiting so the
+ * caller may safely delete the source.
+ *
+ * With -l the copy is limited to MBPS MB/s (not counting reflinks, which don't copy any data) by sleeping between
+ * smaller chunks, so a copy to a slow or shared volume leaves bandwidth for everything else. 0 means no limit.
+ *
+ * Build: gcc -o fcopy fcopy.c
+ * Usage: fcopy [-l MBPS] SRC DST
+ */
+
+#define _GNU_SOURCE
+#include <errno.h>
+#include <fcntl.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/ioctl.h>
+#include <sys/sendfile.h>
+#include <sys/stat.h>
+#include <sys/syscall.h>
+#include <time.h>
+#include <unistd.h>
+
+#ifndef FICLONE
+#define FICLONE _IOW(0x94, 9, int)
+#endif
+
+#define CHUNK (64 * 1024 * 1024)
+#define MIN_CHUNK (1024 * 1024)
+
+
+static struct timespec start;
+static double limit;  // Bytes per second, 0 for no limit.
+static size_t chunk = CHUNK;
+
+
+static double elapsed(struct timespec *start) {
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (now.tv_sec - start->tv_sec) + (now.tv_nsec - start->tv_nsec) / 1e9;
+}
+
+
+// Sleep until copying done bytes has taken as long as the limit allows.
+static void throttle(off_t done) {
+    if (!limit) return;
+    double ahead = done / limit - elapsed(&start);
+    if (ahead <= 0) return;
+    struct timespec ts = {(time_t) ahead, (long) ((ahead - (time_t) ahead) * 1e9)};
+    nanosleep(&ts, NULL);
+}
+
+
+static int unsupported(int err) {
+    return err == EXDEV || err == EINVAL || err == ENOSYS || err == EOPNOTSUPP || err == ENOTTY;
+}
+
+
+/* Copy with copy_file_range() through the raw syscall, glibc in older images lacks the wrapper. */
+static ssize_t range_copy(int in, int out, off_t size) {
+#ifdef __NR_copy_file_range
+    off_t done = 0;
+    while (done < size) {
+        ssize_t n = syscall(__NR_copy_file_range, in, NULL, out, NULL, chunk, 0);
+        if (n < 0) {
+            if (done == 0 && unsupported(errno)) return -2;
+            return -1;
+        }
+        if (n == 0) break;
+        done += n;
+        throttle(done);
+    }
+    return done;
+#else
+    (void) in; (void) out; (void) size;
+    return -2;
+#endif
+}
+
+
+static ssize_t send_copy(int in, int out, off_t size) {
+    off_t done = 0;
+    while (done < size) {
+        ssize_t n = sendfile(out, in, NULL, chunk);
+        if (n < 0) return -1;
+        if (n == 0) break;
+        done += n;
+        throttle(done);
+    }
+    return done;
+}
+
+
+int main(int argc, char *argv[]) {
+    int opt;
+    while ((opt = getopt(argc, argv, "l:")) != -1) {
+        if (opt != 'l') break;
+        limit = atof(optarg) * 1e6;
+    }
+    if (opt != -1 || argc - optind != 2) {
+        fprintf(stderr, "Usage: %s [-l MBPS] SRC DST\n", argv[0]);
+        return 2;
+    }
+    argv += optind - 1;
+
+    // Copy about a tenth of a second's worth at a time when limited.
+    if (limit > 0 && limit / 10 < CHUNK) chunk = limit / 10 > MIN_CHUNK ? (size_t) (limit / 10) : MIN_CHUNK;
+
+    struct stat st;
+    int in = open(argv[1], O_RDONLY);
+    if (in < 0 || fstat(in, &st) < 0) {
+        fprintf(stderr, "fcopy: %s: %s\n", argv[1], strerror(errno));
+        return 1;
+    }
+    int out = open(argv[2], O_WRONLY | O_CREAT | O_TRUNC, st.st_mode & 07777);
+    if (out < 0) {
+        fprintf(stderr, "fcopy: %s: %s\n", argv[2], strerror(errno));
+        return 1;
+    }
+
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    const char *method = "reflink";
+    ssize_t copied = st.st_size;
+    if (ioctl(out, FICLONE, in) < 0) {
+        method = "copy_file_range";
+        copied = range_copy(in, out, st.st_size);
+        if (copied == -2) {
+            method = "sendfile";
+            copied = send_copy(in, out, st.st_size);
+        }
+    }
+    if (copied < 0 || copied != st.st_size) {
+        fprintf(stderr, "fcopy: %s -> %s: %s after %zd bytes\n", argv[1], argv[2],
+                copied < 0 ? strerror(errno) : "short copy", copied < 0 ? (ssize_t) 0 : copied);
+        unlink(argv[2]);
+        return 1;
+    }
+    if (fchmod(out, st.st_mode & 07777) < 0 || fsync(out) < 0 || close(out) < 0) {
+        fprintf(stderr, "fcopy: %s: %s\n", argv[2], strerror(errno));
+        return 1;
+    }
+    close(in);
+
+    double seconds = elapsed(&start);
+    printf("fcopy: %s %zd bytes via %s in %.1fs (%.1f MB/s)\n", argv[1], copied, method, seconds,
+           seconds > 0 ? copied / seconds / 1e6 : 0.0);
+    return 0;
+}
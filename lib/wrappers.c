@@ -15,114 +15,1134 @@
     For named pipe:
         Every time makemkvcon closes an MKV file this library will write the file path to a named pipe maintained by the
         calling bash script. This lets the bash script fire a hook after each MKV file is done ripping while makemkvcon
-        is running.
+        is running. The pipe is WRAPPERS_FIFO (default /tmp/titles_done) so several rips can run side by side. The
+        calling script creates the pipe before starting makemkvcon (it's only created here if it's missing). Once the
+        writer thread is running the constructor sends a readiness record instead of the script polling for it:
+            init <TAB> wall clock milliseconds since the epoch <NUL>
+        The destructor sends "fini" after the last title.
+
+    For tracking file descriptors:
+        makemkvcon closes thousands of descriptors (sockets, pipes, disc files) while scanning a disc. Instead of
+        resolving every one of them through /proc/self/fd in close(3), open(3) records MKV descriptors in a table indexed
+        by file descriptor. close(3) then does a single array lookup and anything untracked goes straight to the real
+        close(3). The directory prefix and file extension are read once in the constructor from WRAPPERS_PREFIX
+        (default "/output/") and WRAPPERS_EXTENSION (default ".mkv").
+
+    For not blocking makemkvcon:
+        close(3) never writes to the named pipe itself. Events go into a bounded in-process ring buffer (size set by
+        WRAPPERS_QUEUE_SIZE, default 64) which a background writer thread drains into the named pipe. A slow
+        hook-post-title.sh only delays the writer thread, not makemkvcon. If the ring buffer is full the event is
+        dropped instead of blocking. The destructor drains the queue and reports the high-water mark, dropped events
+        and events that took longer than WRAPPERS_LATE_MS (default 1000) to reach the named pipe.
+
+    For write instrumentation:
+        write(3) and pwrite(3) are wrapped for tracked MKV descriptors to count bytes, write calls and a write latency
+        histogram. Instead of the bare path the named pipe receives a tab separated record for every title:
+            path <TAB> bytes <TAB> write calls <TAB> open-to-close microseconds <TAB> histogram <NUL>
+        The histogram is a comma separated list of write call counts in HIST_BUCKETS buckets. Bucket 0 counts calls
+        under 1 microsecond and bucket N counts calls taking [2^(N-1), 2^N) microseconds, the last bucket is open ended.
+
+    For read-side I/O tracing:
+        When WRAPPERS_TRACE_IO is set to a file path, read(3), pread(3) and ioctl(2) are also wrapped for descriptors
+        opened on the WRAPPERS_DEVICE optical device (matched by device number, so /dev/cdrom matches /dev/sr0). SCSI
+        READ commands sent through SG_IO are decoded to get the sector address. The destructor writes bytes read per
+        second, a read latency histogram (same buckets as above), failed reads and retries (a read of the same sector
+        right after it failed) to the file as JSON.
+
+    For first read timing:
+        When WRAPPERS_DEVICE is set (with or without WRAPPERS_TRACE_IO) the first read of the optical device puts a
+        record on the named pipe so the bash script can log how long the drive took to deliver its first sector:
+            first_read <TAB> wall clock milliseconds since the epoch when the read was issued <NUL>
+
+    For large output files:
+        Blu-ray MKV files are tens of GB. Written as ordinary buffered files they fill the page cache, fragment extents
+        and make the final sync(1) stall. Each of these is off unless its environment variable is set:
+            WRAPPERS_FALLOCATE_MB   fallocate(2) MKV files this many MiB at a time ahead of the write cursor. Space
+                                    past the end of the file is released with ftruncate(2) in close(3).
+            WRAPPERS_WRITEBACK_MB   Start writeback with sync_file_range(2) every time this many MiB are written.
+            WRAPPERS_DROP_CACHE     If "true" wait for writeback of the previous window then drop it from the page
+                                    cache with posix_fadvise(POSIX_FADV_DONTNEED). Uses a 64 MiB window when
+                                    WRAPPERS_WRITEBACK_MB is unset. Keeps memory use flat for the whole rip.
+
+    For checksums:
+        When WRAPPERS_CHECKSUM is "true" the bytes written to every MKV file are hashed as they pass through write(3)
+        and pwrite(3) so nothing has to read a 40 GB file back after the rip. write(3) only copies the buffer into a
+        queue (bounded by WRAPPERS_CHECKSUM_MB, default 128) which a background hasher thread drains, so makemkvcon
+        never waits for SHA-256. The file is hashed in CHUNK_MB chunks and the digest is the SHA-256 of the chunk
+        digests, each as a lowercase hex line:
+            for each chunk: sha256sum of the chunk |cut -c1-64     then sha256sum of those lines
+        Muxers go back and rewrite headers at the end, so a chunk that is written to again after it was hashed is
+        marked dirty instead of invalidating the whole file. The same happens to data that didn't fit in the queue.
+        Once the file is closed the hasher reads only dirty chunks back, then appends the digest to the title record:
+            path <TAB> bytes <TAB> write calls <TAB> open-to-close microseconds <TAB> histogram <TAB> digest <NUL>
+        Titles are reported in the order they were closed. The destructor waits for the hasher before sending "fini".
 
     Build:
-    gcc -o wrappers.so wrappers.c -fPIC -shared
+    gcc -o wrappers.so wrappers.c -fPIC -shared -pthread
 
     Usage:
     LD_PRELOAD=/wrappers.so makemkvcon ...
+
+    Benchmark:
+    ./bench.sh
  */
 
 #define _GNU_SOURCE
 #define ERROR(msg) fprintf(stderr, "ERROR %s:%d %s: %s\n", __FILE__, __LINE__, __PRETTY_FUNCTION__, msg)
 #define FIFO_FILE "/tmp/titles_done"
-#define O_WRONLY 00000001
+#define MAX_TRACKED_FDS 65536
+#define QUEUE_SIZE 64
+#define LATE_MS 1000
+#define HIST_BUCKETS 24
+#define SECTOR_SIZE 2048
+#define TIMELINE_SECONDS 86400
+#define WINDOW_MB 64
+#define CHUNK_MB 64
+#define HASH_QUEUE_MB 128
 
 #include <dlfcn.h>
 #include <errno.h>
+#include <fcntl.h>
+#include <pthread.h>
+#include <scsi/sg.h>
+#include <stdarg.h>
 #include <stdbool.h>
+#include <stdint.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <sys/resource.h>
 #include <sys/stat.h>
+#include <time.h>
+#include <unistd.h>
+
+
+// Incremental SHA-256 state.
+struct sha256 {
+    uint32_t state[8];
+    uint64_t length;
+    unsigned char block[64];
+    size_t used;
+};
+
+
+// Chunk states of a title's checksum. See "For checksums" above.
+enum {CHUNK_MISSING, CHUNK_HASHED, CHUNK_DIRTY};
+
+
+// An MKV file opened by makemkvcon, stored in the file descriptor table.
+struct title {
+    char *path;
+    long long opened_ns;
+    unsigned long long bytes;
+    unsigned long writes;
+    unsigned long hist[HIST_BUCKETS];
+    off_t end;  // Highest offset written so far.
+    off_t allocated;  // End of fallocate(2)d space, -1 if the filesystem doesn't support it.
+    off_t flushed;  // End of the last window handed to writeback.
+    off_t dropped;  // End of the last window dropped from the page cache.
+    // Checksum state, only touched by the hasher thread except for rehash.
+    struct sha256 sha;
+    long chunk;  // Chunk being fed into sha, -1 if none.
+    off_t hashed;  // End of the bytes fed so far.
+    long chunks;  // Size of the digests and states arrays.
+    unsigned char (*digests)[32];
+    unsigned char *states;
+    bool rehash;  // Set if a write could not be queued, the whole file is read back.
+    struct hash_job *release;  // Allocated in open(3) so the title can always be handed back to the hasher thread.
+};
+
+
+// Data written to an MKV file waiting for the hasher thread, or the file being closed.
+struct hash_job {
+    struct title *title;
+    off_t offset;  // File size when closing.
+    char *data;  // NULL if the bytes didn't fit in the queue, their chunks are read back later.
+    size_t size;
+    char *record;  // Named pipe record of a closed file, the digest is appended to it.
+    bool closing;
+    struct hash_job *next;
+};
+
+
+// A message waiting in the ring buffer to be written to the named pipe.
+struct event {
+    char *data;  // Includes the trailing null byte.
+    size_t size;
+    long long queued_ns;
+};
+
+
+// Bounded ring buffer drained by the writer thread.
+static struct {
+    pthread_mutex_t lock;
+    pthread_cond_t cond;
+    pthread_t thread;
+    struct event *events;
+    unsigned size, head, count;
+    bool running, stopping;
+    unsigned high_water;
+    unsigned long total, dropped, late;
+    long long late_ns, max_latency_ns;
+} queue = {.lock = PTHREAD_MUTEX_INITIALIZER, .cond = PTHREAD_COND_INITIALIZER};
+
+
+// Read-side statistics for the optical device. Only collected when WRAPPERS_DEVICE is set, only written out when
+// WRAPPERS_TRACE_IO is also set.
+static struct {
+    pthread_mutex_t lock;
+    const char *output;
+    const char *device;
+    dev_t rdev;
+    bool *fds;  // Indexed by file descriptor, same size as fd_table.
+    long long started_ns;
+    unsigned long long bytes;
+    unsigned long reads, errors, retries, ioctls;
+    long long failed_sector;
+    unsigned long hist[HIST_BUCKETS];
+    unsigned long long *timeline;  // Bytes read per second since the first read.
+    int timeline_len;
+    double earlier_seconds;  // Of earlier makemkvcon runs of the same rip, their seconds come first in the timeline.
+    int earlier_len;
+} trace = {.lock = PTHREAD_MUTEX_INITIALIZER, .failed_sector = -1};
+
+
+// Unbounded list of hash jobs, the copied data is bounded by limit bytes.
+static struct {
+    pthread_mutex_t lock;
+    pthread_cond_t cond;
+    pthread_t thread;
+    struct hash_job *head, *tail;
+    size_t pending, limit;
+    bool running, stopping;
+    unsigned long titles;
+    unsigned long long hashed, reread;
+} hasher = {.lock = PTHREAD_MUTEX_INITIALIZER, .cond = PTHREAD_COND_INITIALIZER};
+
+
+static const uint32_t sha256_k[64] = {
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2,
+};
+
+
+// Page cache and preallocation settings for MKV files. A size of 0 disables the feature.
+static struct {
+    off_t fallocate;
+    off_t writeback;
+    bool drop_cache;
+    off_t window;
+} io;
 
 
+static const char *fifo_file = FIFO_FILE;
+static const char *prefix = "/output/";
+static size_t prefix_len;
+static const char *extension = ".mkv";
+static size_t extension_len;
+static struct title **fd_table;
+static int fd_table_size;
 static int fifo_fd;
 static int (*real_close)(int fd);
-static int (*real_open)(const char *path, int flags, mode_t mode);
+static int (*real_open)(const char *path, int flags, ...);
+static ssize_t (*real_write)(int fd, const void *buf, size_t count);
+static ssize_t (*real_pwrite)(int fd, const void *buf, size_t count, off_t offset);
+static ssize_t (*real_read)(int fd, void *buf, size_t count);
+static ssize_t (*real_pread)(int fd, void *buf, size_t count, off_t offset);
+static int (*real_ioctl)(int fd, unsigned long request, void *arg);
 static void init(void) __attribute__((constructor));
 static void fini(void) __attribute__((destructor));
+static void forked(void);
+static void enqueue(char *data, size_t size);
+static long long wall_ms(void);
+static void *writer(void *arg);
+static void manage(struct title *title, int fd, off_t end);
+static void trace_init(void);
+static void trace_load(void);
+static void trace_dump(void);
+static void hasher_init(void);
+static void hasher_stop(void);
+static void *hash_thread(void *arg);
 
 
 // Constructor.
 static void init(void) {
     real_close = dlsym(RTLD_NEXT, "close");
     real_open = dlsym(RTLD_NEXT, "open");
+    real_write = dlsym(RTLD_NEXT, "write");
+    real_pwrite = dlsym(RTLD_NEXT, "pwrite");
+    real_read = dlsym(RTLD_NEXT, "read");
+    real_pread = dlsym(RTLD_NEXT, "pread");
+    real_ioctl = dlsym(RTLD_NEXT, "ioctl");
+
+    // Read configuration once so open() doesn't have to.
+    char *env;
+    if ((env = getenv("WRAPPERS_PREFIX")) && *env) prefix = env;
+    if ((env = getenv("WRAPPERS_FIFO")) && *env) fifo_file = env;
+    if ((env = getenv("WRAPPERS_EXTENSION")) && *env) extension = env;
+    prefix_len = strlen(prefix);
+    extension_len = strlen(extension);
+    queue.size = (env = getenv("WRAPPERS_QUEUE_SIZE")) && atoi(env) > 0 ? atoi(env) : QUEUE_SIZE;
+    queue.late_ns = ((env = getenv("WRAPPERS_LATE_MS")) && atoi(env) > 0 ? atoi(env) : LATE_MS) * 1000000LL;
+    if ((env = getenv("WRAPPERS_FALLOCATE_MB")) && atoi(env) > 0) io.fallocate = atoi(env) * 1048576LL;
+    if ((env = getenv("WRAPPERS_WRITEBACK_MB")) && atoi(env) > 0) io.writeback = atoi(env) * 1048576LL;
+    io.drop_cache = (env = getenv("WRAPPERS_DROP_CACHE")) && !strcmp(env, "true");
+    io.window = io.writeback ? io.writeback : WINDOW_MB * 1048576LL;
+
+    // Size the file descriptor table from the soft limit. Descriptors above it are never tracked.
+    struct rlimit limit;
+    if (getrlimit(RLIMIT_NOFILE, &limit) == 0 && limit.rlim_cur != RLIM_INFINITY && limit.rlim_cur < MAX_TRACKED_FDS) {
+        fd_table_size = (int) limit.rlim_cur;
+    } else {
+        fd_table_size = MAX_TRACKED_FDS;
+    }
+    if (!(fd_table = calloc(fd_table_size, sizeof *fd_table))) {
+        fd_table_size = 0;
+        ERROR("Failed to allocate file descriptor table, MKV files will not be tracked.");
+    }
+    trace_init();
+    pthread_atfork(NULL, NULL, forked);
 
     // Create and open fifo file.
     char error_str[255];
-    if (mkfifo(FIFO_FILE, 0600) == -1) {
-        sprintf(error_str, "Failed to create %s: %d %s", FIFO_FILE, errno, strerror(errno));
+    if (mkfifo(fifo_file, 0600) == -1 && errno != EEXIST) {
+        snprintf(error_str, sizeof error_str, "Failed to create %s: %d %s", fifo_file, errno, strerror(errno));
+        ERROR(error_str);
+    } else if ((fifo_fd = open(fifo_file, O_WRONLY)) == -1) {
+        snprintf(error_str, sizeof error_str, "Failed to open %s for writing: %d %s", fifo_file, errno, strerror(errno));
         ERROR(error_str);
-    } else if ((fifo_fd = open(FIFO_FILE, O_WRONLY)) == -1) {
-        sprintf(error_str, "Failed to open %s for writing: %d %s", FIFO_FILE, errno, strerror(errno));
+    } else if (!(queue.events = calloc(queue.size, sizeof *queue.events))) {
+        ERROR("Failed to allocate event queue.");
+    } else if ((errno = pthread_create(&queue.thread, NULL, writer, NULL))) {
+        sprintf(error_str, "Failed to start writer thread: %d %s", errno, strerror(errno));
         ERROR(error_str);
     } else {
-        dprintf(fifo_fd, "%s%c", __func__, 0);
+        queue.running = true;
+        char *record;
+        int size = asprintf(&record, "%s\t%lld", __func__, wall_ms());
+        if (size > 0) enqueue(record, size + 1);  // Includes null byte.
+        hasher_init();
     }
 }
 
 
 // Destructor.
 static void fini(void) {
-    if (fifo_fd > 0) {
-        dprintf(fifo_fd, "%s%c", __func__, 0);
-        real_close(fifo_fd);
+    trace_dump();
+    if (!queue.running) return;
+    hasher_stop();  // Sends the records of titles still being hashed.
+    enqueue(strdup(__func__), sizeof __func__);
+
+    // Let the writer thread drain the queue then exit.
+    pthread_mutex_lock(&queue.lock);
+    queue.stopping = true;
+    pthread_cond_signal(&queue.cond);
+    pthread_mutex_unlock(&queue.lock);
+    pthread_join(queue.thread, NULL);
+    queue.running = false;
+    real_close(fifo_fd);
+
+    // Report how close the consumer came to stalling makemkvcon.
+    fprintf(
+        stderr, "wrappers.so: %lu events, queue high-water mark %u/%u, %lu dropped, %lu late, max latency %lld ms\n",
+        queue.total, queue.high_water, queue.size, queue.dropped, queue.late, queue.max_latency_ns / 1000000
+    );
+}
+
+
+// Reset state in a child process. Only the thread that called fork(2) is copied: the writer and hasher threads are
+// gone and their locks may be held forever, so the child sends no records and doesn't join threads in fini().
+static void forked(void) {
+    pthread_mutex_init(&queue.lock, NULL);
+    pthread_cond_init(&queue.cond, NULL);
+    pthread_mutex_init(&hasher.lock, NULL);
+    pthread_cond_init(&hasher.cond, NULL);
+    pthread_mutex_init(&trace.lock, NULL);
+    if (queue.running) real_close(fifo_fd);
+    queue.running = false;
+    hasher.running = false;
+    hasher.head = hasher.tail = NULL;  // Jobs of the parent, never freed.
+    hasher.pending = 0;
+    trace.output = NULL;  // The parent writes the trace.
+
+    // Inherited titles are freed on close(2) instead of being handed to the hasher thread.
+    for (int fd = 0; fd < fd_table_size; fd++) {
+        if (!fd_table[fd] || !fd_table[fd]->release) continue;
+        free(fd_table[fd]->release);
+        fd_table[fd]->release = NULL;
+    }
+}
+
+
+// Return wall clock time in milliseconds since the epoch, comparable with "date +%s%3N" in bash.
+static long long wall_ms(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_REALTIME, &ts);
+    return ts.tv_sec * 1000LL + ts.tv_nsec / 1000000;
+}
+
+
+// Return monotonic time in nanoseconds.
+static long long now_ns(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000000000LL + ts.tv_nsec;
+}
+
+
+// Add a message to the ring buffer without ever blocking on the named pipe. Takes ownership of data.
+static void enqueue(char *data, size_t size) {
+    if (!data) return;
+    pthread_mutex_lock(&queue.lock);
+    queue.total++;
+    if (queue.count == queue.size || queue.stopping) {
+        queue.dropped++;
+        pthread_mutex_unlock(&queue.lock);
+        free(data);
+        return;
+    }
+    struct event *event = &queue.events[(queue.head + queue.count++) % queue.size];
+    event->data = data;
+    event->size = size;
+    event->queued_ns = now_ns();
+    if (queue.count > queue.high_water) queue.high_water = queue.count;
+    pthread_cond_signal(&queue.cond);
+    pthread_mutex_unlock(&queue.lock);
+}
+
+
+// Writer thread. Drains the ring buffer into the named pipe until the destructor says stop.
+static void *writer(void *arg) {
+    (void) arg;
+    pthread_mutex_lock(&queue.lock);
+    while (true) {
+        while (!queue.count && !queue.stopping) pthread_cond_wait(&queue.cond, &queue.lock);
+        if (!queue.count) break;
+        struct event event = queue.events[queue.head];
+        queue.head = (queue.head + 1) % queue.size;
+        queue.count--;
+        pthread_mutex_unlock(&queue.lock);
+
+        // Blocks while bash is busy running hooks.
+        real_write(fifo_fd, event.data, event.size);
+        free(event.data);
+        long long latency = now_ns() - event.queued_ns;
+
+        pthread_mutex_lock(&queue.lock);
+        if (latency > queue.late_ns) queue.late++;
+        if (latency > queue.max_latency_ns) queue.max_latency_ns = latency;
+    }
+    pthread_mutex_unlock(&queue.lock);
+    return NULL;
+}
+
+
+// Return the histogram bucket of a duration. See "For write instrumentation" above.
+static int bucket(long long elapsed_ns) {
+    long long us = elapsed_ns / 1000;
+    int bucket = us > 0 ? 64 - __builtin_clzll(us) : 0;
+    return bucket < HIST_BUCKETS ? bucket : HIST_BUCKETS - 1;
+}
+
+
+// Enable read-side tracing if WRAPPERS_TRACE_IO and WRAPPERS_DEVICE are set.
+static void trace_init(void) {
+    trace.output = getenv("WRAPPERS_TRACE_IO");
+    trace.device = getenv("WRAPPERS_DEVICE");
+    if (trace.output && !*trace.output) trace.output = NULL;
+    if (!trace.device || !*trace.device || !fd_table_size) return;
+
+    char error_str[255];
+    struct stat st;
+    if (stat(trace.device, &st) == -1) {
+        snprintf(error_str, sizeof error_str, "Failed to stat %s: %d %s", trace.device, errno, strerror(errno));
+        ERROR(error_str);
+        return;
+    }
+    trace.rdev = st.st_rdev;
+    trace.fds = calloc(fd_table_size, sizeof *trace.fds);
+    trace.timeline = calloc(TIMELINE_SECONDS, sizeof *trace.timeline);  // Untouched pages are never faulted in.
+    if (!trace.fds || !trace.timeline) {
+        free(trace.fds);
+        free(trace.timeline);
+        trace.fds = NULL;
+        ERROR("Failed to allocate I/O trace tables, I/O will not be traced.");
+    } else if (trace.output) {
+        trace_load();
+    }
+}
+
+
+// Add up the statistics an earlier makemkvcon run of the same rip wrote, rip.sh runs one per title when picking titles.
+// run_makemkvcon() removes the file before the first run. A file that doesn't parse is overwritten.
+static void trace_load(void) {
+    FILE *file = fopen(trace.output, "r");
+    if (!file) return;
+    double seconds;
+    unsigned long reads, errors, retries, ioctls, hist[HIST_BUCKETS];
+    unsigned long long bytes, value;
+    int ok = fscanf(
+        file, " { \"device\": \"%*[^\"]\", \"seconds\": %lf, \"reads\": %lu, \"bytes\": %llu, \"mbps\": %*f,"
+        " \"errors\": %lu, \"retries\": %lu, \"other_ioctls\": %lu, \"read_latency_hist\": [",
+        &seconds, &reads, &bytes, &errors, &retries, &ioctls
+    ) == 6;
+    for (int i = 0; ok && i < HIST_BUCKETS; i++) ok = fscanf(file, i ? " , %lu" : " %lu", &hist[i]) == 1;
+    if (ok) ok = fscanf(file, " ] , \"bytes_per_second\": [") != EOF;
+    if (!ok) {
+        fclose(file);
+        return;
+    }
+    trace.earlier_seconds = seconds;
+    trace.reads = reads;
+    trace.bytes = bytes;
+    trace.errors = errors;
+    trace.retries = retries;
+    trace.ioctls = ioctls;
+    for (int i = 0; i < HIST_BUCKETS; i++) trace.hist[i] = hist[i];
+    while (trace.earlier_len < TIMELINE_SECONDS && fscanf(file, trace.earlier_len ? " , %llu" : " %llu", &value) == 1) {
+        trace.timeline[trace.earlier_len++] = value;
+    }
+    trace.timeline_len = trace.earlier_len;
+    fclose(file);
+}
+
+
+// Determine if a file descriptor was opened on the traced optical device.
+static bool is_device(int fd) {
+    return trace.fds && fd >= 0 && fd < fd_table_size && trace.fds[fd];
+}
+
+
+// Record one read request against the optical device. Sector is -1 if unknown.
+static void trace_read(long long sector, ssize_t bytes, bool failed, long long elapsed_ns) {
+    long long now = now_ns();
+    bool first = false;
+    pthread_mutex_lock(&trace.lock);
+    if (!trace.started_ns) {
+        trace.started_ns = now - elapsed_ns;
+        first = true;
+    }
+    trace.reads++;
+    trace.hist[bucket(elapsed_ns)]++;
+    if (failed) {
+        trace.errors++;
+        if (sector >= 0 && sector == trace.failed_sector) trace.retries++;
+        trace.failed_sector = sector;
+    } else {
+        if (sector >= 0 && sector == trace.failed_sector) trace.retries++;
+        trace.failed_sector = -1;
+        trace.bytes += bytes;
+        int second = trace.earlier_len + (int) ((now - trace.started_ns) / 1000000000LL);
+        if (second < TIMELINE_SECONDS) {
+            trace.timeline[second] += bytes;
+            if (second >= trace.timeline_len) trace.timeline_len = second + 1;
+        }
+    }
+    pthread_mutex_unlock(&trace.lock);
+    if (first && queue.running) {
+        char *record;
+        int size = asprintf(&record, "first_read\t%lld", wall_ms() - elapsed_ns / 1000000);
+        if (size > 0) enqueue(record, size + 1);  // Includes null byte.
     }
 }
 
 
+// Decode a SCSI command sent through SG_IO. Only READ commands are recorded as reads.
+static void trace_sg_io(sg_io_hdr_t *hdr, int ret, long long elapsed_ns) {
+    if (!hdr || hdr->interface_id != 'S' || !hdr->cmdp || hdr->cmd_len < 6) {
+        __atomic_fetch_add(&trace.ioctls, 1, __ATOMIC_RELAXED);
+        return;
+    }
+    unsigned char *cdb = hdr->cmdp;
+    long long sector = 0;
+    switch (cdb[0]) {
+        case 0x28:  // READ(10)
+        case 0xA8:  // READ(12)
+        case 0xBE:  // READ CD
+            for (int i = 2; i < 6; i++) sector = sector << 8 | cdb[i];
+            break;
+        case 0x88:  // READ(16)
+            if (hdr->cmd_len < 16) return;
+            for (int i = 2; i < 10; i++) sector = sector << 8 | cdb[i];
+            break;
+        default:
+            __atomic_fetch_add(&trace.ioctls, 1, __ATOMIC_RELAXED);
+            return;
+    }
+    bool failed = ret < 0 || hdr->status || hdr->host_status || hdr->driver_status;
+    trace_read(sector, failed ? 0 : (ssize_t) hdr->dxfer_len - hdr->resid, failed, elapsed_ns);
+}
+
+
+// Write collected read-side statistics as JSON.
+static void trace_dump(void) {
+    if (!trace.fds || !trace.started_ns || !trace.output) return;  // Keep the file of earlier runs if nothing was read.
+    FILE *file = fopen(trace.output, "w");
+    if (!file) {
+        char error_str[255];
+        snprintf(error_str, sizeof error_str, "Failed to open %s: %d %s", trace.output, errno, strerror(errno));
+        ERROR(error_str);
+        return;
+    }
+    pthread_mutex_lock(&trace.lock);
+    double seconds = trace.earlier_seconds + (now_ns() - trace.started_ns) / 1e9;
+    fprintf(file, "{\n  \"device\": \"%s\",\n  \"seconds\": %.3f,\n", trace.device, seconds);
+    fprintf(file, "  \"reads\": %lu,\n  \"bytes\": %llu,\n", trace.reads, trace.bytes);
+    fprintf(file, "  \"mbps\": %.2f,\n", seconds > 0 ? trace.bytes / seconds / 1e6 : 0);
+    fprintf(file, "  \"errors\": %lu,\n  \"retries\": %lu,\n", trace.errors, trace.retries);
+    fprintf(file, "  \"other_ioctls\": %lu,\n  \"read_latency_hist\": [", trace.ioctls);
+    for (int i = 0; i < HIST_BUCKETS; i++) fprintf(file, "%s%lu", i ? ", " : "", trace.hist[i]);
+    fprintf(file, "],\n  \"bytes_per_second\": [");
+    for (int i = 0; i < trace.timeline_len; i++) fprintf(file, "%s%llu", i ? ", " : "", trace.timeline[i]);
+    fprintf(file, "]\n}\n");
+    pthread_mutex_unlock(&trace.lock);
+    fclose(file);
+}
+
+
 // Determine if path is an MKV file we're interested in.
 bool is_mkv(const char *path) {
-    // Shortest possible "valid" path is "/output/title00.mkv" which is 19 chars.
-    if (!path || strlen(path) < 19) return false;
+    if (!path) return false;
 
-    // Make sure file is in /output.
-    if (strncmp("/output/", path, sizeof("/output/") - 1) != 0) return false;
+    // Shortest possible "valid" path is "/output/title00.mkv" which is 19 chars with the default prefix and extension.
+    size_t len = strlen(path);
+    if (len < prefix_len + extension_len + 1) return false;
 
-    // Lastly make sure file extension is ".mkv".
-    char *dot = strrchr(path, '.');
-    return dot && !strcmp(dot, ".mkv");
+    // Make sure file is in /output and file extension is ".mkv".
+    return !strncmp(prefix, path, prefix_len) && !strcmp(extension, path + len - extension_len);
 }
 
 
-// Return true if file is not empty.
-bool not_empty(const char *path) {
-    struct stat st;
-    stat(path, &st);
-    off_t size = st.st_size;
-    return size > 0;
+// Return the table entry of a file descriptor, or NULL if it isn't tracked.
+static struct title *tracked(int fd) {
+    if (fd < 0 || fd >= fd_table_size) return NULL;
+    return __atomic_load_n(&fd_table[fd], __ATOMIC_ACQUIRE);
+}
+
+
+// Remove a file descriptor from the table and return its entry, or NULL if it wasn't tracked.
+static struct title *untrack(int fd) {
+    if (fd < 0 || fd >= fd_table_size) return NULL;
+    if (!fd_table[fd]) return NULL;  // Untracked descriptors take this path without an atomic write.
+    return __atomic_exchange_n(&fd_table[fd], NULL, __ATOMIC_ACQ_REL);
 }
 
 
-// Wrapping open() function call for umask purposes.
-int open(const char *path, int flags, mode_t mode) {
+// Free a title table entry.
+static void free_title(struct title *title) {
+    if (!title) return;
+    free(title->path);
+    free(title->digests);
+    free(title->states);
+    free(title);
+}
+
+
+#define ROR(x, n) ((x) >> (n) | (x) << (32 - (n)))
+
+
+// Compress one 64 byte block into a SHA-256 state.
+static void sha256_block(struct sha256 *sha, const unsigned char *p) {
+    uint32_t w[64], s[8];
+    for (int i = 0; i < 16; i++) {
+        w[i] = (uint32_t) p[i * 4] << 24 | (uint32_t) p[i * 4 + 1] << 16 | (uint32_t) p[i * 4 + 2] << 8 | p[i * 4 + 3];
+    }
+    for (int i = 16; i < 64; i++) {
+        uint32_t s0 = ROR(w[i - 15], 7) ^ ROR(w[i - 15], 18) ^ w[i - 15] >> 3;
+        uint32_t s1 = ROR(w[i - 2], 17) ^ ROR(w[i - 2], 19) ^ w[i - 2] >> 10;
+        w[i] = w[i - 16] + s0 + w[i - 7] + s1;
+    }
+    memcpy(s, sha->state, sizeof s);
+    for (int i = 0; i < 64; i++) {
+        uint32_t t1 = s[7] + (ROR(s[4], 6) ^ ROR(s[4], 11) ^ ROR(s[4], 25)) + ((s[4] & s[5]) ^ (~s[4] & s[6]))
+            + sha256_k[i] + w[i];
+        uint32_t t2 = (ROR(s[0], 2) ^ ROR(s[0], 13) ^ ROR(s[0], 22)) + ((s[0] & s[1]) ^ (s[0] & s[2]) ^ (s[1] & s[2]));
+        memmove(s + 1, s, 7 * sizeof *s);
+        s[4] += t1;
+        s[0] = t1 + t2;
+    }
+    for (int i = 0; i < 8; i++) sha->state[i] += s[i];
+}
+
+
+static void sha256_init(struct sha256 *sha) {
+    static const uint32_t initial[8] = {
+        0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19,
+    };
+    memcpy(sha->state, initial, sizeof initial);
+    sha->length = 0;
+    sha->used = 0;
+}
+
+
+static void sha256_update(struct sha256 *sha, const unsigned char *data, size_t size) {
+    sha->length += size;
+    if (sha->used) {
+        size_t n = 64 - sha->used < size ? 64 - sha->used : size;
+        memcpy(sha->block + sha->used, data, n);
+        sha->used += n;
+        data += n;
+        size -= n;
+        if (sha->used < 64) return;
+        sha256_block(sha, sha->block);
+        sha->used = 0;
+    }
+    for (; size >= 64; data += 64, size -= 64) sha256_block(sha, data);
+    memcpy(sha->block, data, size);
+    sha->used = size;
+}
+
+
+static void sha256_final(struct sha256 *sha, unsigned char digest[32]) {
+    uint64_t bits = sha->length * 8;
+    sha->block[sha->used++] = 0x80;
+    if (sha->used > 56) {
+        memset(sha->block + sha->used, 0, 64 - sha->used);
+        sha256_block(sha, sha->block);
+        sha->used = 0;
+    }
+    memset(sha->block + sha->used, 0, 56 - sha->used);
+    for (int i = 0; i < 8; i++) sha->block[56 + i] = bits >> (56 - i * 8);
+    sha256_block(sha, sha->block);
+    for (int i = 0; i < 32; i++) digest[i] = sha->state[i / 4] >> (24 - i % 4 * 8);
+}
+
+
+// Start the hasher thread if WRAPPERS_CHECKSUM is "true". Called once the named pipe writer is running.
+static void hasher_init(void) {
+    char *env = getenv("WRAPPERS_CHECKSUM");
+    if (!env || strcmp(env, "true")) return;
+    hasher.limit = ((env = getenv("WRAPPERS_CHECKSUM_MB")) && atoi(env) > 0 ? atoi(env) : HASH_QUEUE_MB) * 1048576LL;
+    if ((errno = pthread_create(&hasher.thread, NULL, hash_thread, NULL))) {
+        char error_str[255];
+        snprintf(error_str, sizeof error_str, "Failed to start hasher thread: %d %s", errno, strerror(errno));
+        ERROR(error_str);
+        return;
+    }
+    hasher.running = true;
+}
+
+
+// Let the hasher thread finish every queued job then exit.
+static void hasher_stop(void) {
+    if (!hasher.running) return;
+    pthread_mutex_lock(&hasher.lock);
+    hasher.stopping = true;
+    pthread_cond_signal(&hasher.cond);
+    pthread_mutex_unlock(&hasher.lock);
+    pthread_join(hasher.thread, NULL);
+    hasher.running = false;
+    fprintf(
+        stderr, "wrappers.so: %lu titles checksummed, %llu MiB hashed while writing, %llu MiB read back\n",
+        hasher.titles, hasher.hashed / 1048576, hasher.reread / 1048576
+    );
+}
+
+
+// Append a job to the hasher's list. Never blocks on hashing.
+static void hash_enqueue(struct hash_job *job) {
+    pthread_mutex_lock(&hasher.lock);
+    if (job->data) hasher.pending += job->size;
+    if (hasher.tail) {
+        hasher.tail->next = job;
+    } else {
+        hasher.head = job;
+    }
+    hasher.tail = job;
+    pthread_cond_signal(&hasher.cond);
+    pthread_mutex_unlock(&hasher.lock);
+}
+
+
+// Queue bytes written to a title at offset. Copies them unless the queue is full.
+static void hash_write(struct title *title, off_t offset, const void *buf, size_t size) {
+    struct hash_job *job = calloc(1, sizeof *job);
+    if (!job) {
+        __atomic_store_n(&title->rehash, true, __ATOMIC_RELAXED);
+        return;
+    }
+    job->title = title;
+    job->offset = offset;
+    job->size = size;
+    if (__atomic_load_n(&hasher.pending, __ATOMIC_RELAXED) + size <= hasher.limit && (job->data = malloc(size))) {
+        memcpy(job->data, buf, size);
+    }
+    hash_enqueue(job);
+}
+
+
+// Make sure the chunk arrays of a title reach offset end. Returns false if out of memory.
+static bool hash_grow(struct title *title, off_t end) {
+    long chunks = (end + CHUNK_MB * 1048576LL - 1) / (CHUNK_MB * 1048576LL);
+    if (chunks <= title->chunks) return true;
+    long size = title->chunks ? title->chunks : 64;
+    while (size < chunks) size *= 2;
+    unsigned char (*digests)[32] = realloc(title->digests, size * sizeof *digests);
+    if (digests) title->digests = digests;
+    unsigned char *states = realloc(title->states, size);
+    if (!digests || !states) return false;
+    memset(states + title->chunks, CHUNK_MISSING, size - title->chunks);
+    title->states = states;
+    title->chunks = size;
+    return true;
+}
+
+
+// Mark every chunk between two offsets dirty so it's read back once the file is closed.
+static void hash_dirty(struct title *title, off_t start, off_t end) {
+    if (start >= end) return;
+    for (long i = start / (CHUNK_MB * 1048576LL); i <= (end - 1) / (CHUNK_MB * 1048576LL); i++) {
+        title->states[i] = CHUNK_DIRTY;
+    }
+}
+
+
+// Feed bytes written at offset into a title's chunk digests. data is NULL if they weren't copied.
+static void hash_feed(struct title *title, off_t offset, const unsigned char *data, size_t size) {
+    const off_t chunk_size = CHUNK_MB * 1048576LL;
+    off_t end = offset + size;
+    if (!hash_grow(title, end)) {
+        title->rehash = true;
+        return;
+    }
+    if (!data) {
+        hash_dirty(title, offset, end);
+        if (end > title->hashed) title->hashed = end;
+        return;
+    }
+    if (offset < title->hashed) {  // Rewrites bytes hashed before, e.g. header updates.
+        hash_dirty(title, offset, end < title->hashed ? end : title->hashed);
+        if (end <= title->hashed) return;
+        data += title->hashed - offset;
+        offset = title->hashed;
+    } else if (offset > title->hashed) {  // Skips ahead, whatever ends up in the hole is read back.
+        hash_dirty(title, title->hashed, offset);
+    }
+    while (offset < end) {
+        long chunk = offset / chunk_size;
+        off_t chunk_end = (chunk + 1) * chunk_size;
+        size_t n = end < chunk_end ? end - offset : chunk_end - offset;
+        if (chunk != title->chunk) {
+            sha256_init(&title->sha);
+            title->chunk = chunk;
+            if (offset % chunk_size) title->states[chunk] = CHUNK_DIRTY;
+        }
+        if (title->states[chunk] != CHUNK_DIRTY) {
+            sha256_update(&title->sha, data, n);
+            hasher.hashed += n;
+        }
+        offset += n;
+        data += n;
+        if (offset == chunk_end) {
+            if (title->states[chunk] != CHUNK_DIRTY) {
+                sha256_final(&title->sha, title->digests[chunk]);
+                title->states[chunk] = CHUNK_HASHED;
+            }
+            title->chunk = -1;
+        }
+    }
+    title->hashed = end;
+}
+
+
+// Finish the digest of a closed file of the given size, reading back chunks that weren't hashed. Writes 64 hex
+// characters and a null byte to hex, or "-" if the file couldn't be read.
+static void hash_close(struct title *title, off_t size, char hex[65]) {
+    const off_t chunk_size = CHUNK_MB * 1048576LL;
+    long chunks = (size + chunk_size - 1) / chunk_size;
+    strcpy(hex, "-");
+    if (!hash_grow(title, size)) return;
+    if (title->hashed > size) hash_dirty(title, size - 1, size);  // Truncated after it was written.
+    bool rehash = __atomic_load_n(&title->rehash, __ATOMIC_RELAXED);
+    if (title->chunk == chunks - 1 && title->hashed == size && title->states[title->chunk] != CHUNK_DIRTY) {
+        sha256_final(&title->sha, title->digests[title->chunk]);
+        title->states[title->chunk] = CHUNK_HASHED;
+    }
+
+    // Read back what's missing.
+    int fd = -1;
+    unsigned char *buf = NULL;
+    for (long i = 0; i < chunks; i++) {
+        if (title->states[i] == CHUNK_HASHED && !rehash) continue;
+        if (fd < 0 && ((fd = real_open(title->path, O_RDONLY)) < 0 || !(buf = malloc(1048576)))) goto out;
+        struct sha256 sha;
+        sha256_init(&sha);
+        for (off_t offset = i * chunk_size; offset < (i + 1) * chunk_size && offset < size;) {
+            ssize_t n = real_pread(fd, buf, 1048576, offset);
+            if (n <= 0) goto out;
+            sha256_update(&sha, buf, n);
+            hasher.reread += n;
+            offset += n;
+        }
+        sha256_final(&sha, title->digests[i]);
+    }
+
+    // Digest of the chunk digests, one hex line each.
+    struct sha256 sha;
+    char line[65];
+    sha256_init(&sha);
+    for (long i = 0; i < chunks; i++) {
+        for (int j = 0; j < 32; j++) sprintf(line + j * 2, "%02x", title->digests[i][j]);
+        line[64] = '\n';
+        sha256_update(&sha, (unsigned char *) line, sizeof line);
+    }
+    unsigned char digest[32];
+    sha256_final(&sha, digest);
+    for (int j = 0; j < 32; j++) sprintf(hex + j * 2, "%02x", digest[j]);
+    hasher.titles++;
+
+out:
+    if (fd >= 0) real_close(fd);
+    free(buf);
+}
+
+
+// Hasher thread. Hashes queued writes in order and sends the record of each closed file with its digest.
+static void *hash_thread(void *arg) {
+    (void) arg;
+    pthread_mutex_lock(&hasher.lock);
+    while (true) {
+        while (!hasher.head && !hasher.stopping) pthread_cond_wait(&hasher.cond, &hasher.lock);
+        struct hash_job *job = hasher.head;
+        if (!job) break;
+        if (!(hasher.head = job->next)) hasher.tail = NULL;
+        pthread_mutex_unlock(&hasher.lock);
+
+        if (!job->closing) {
+            hash_feed(job->title, job->offset, (unsigned char *) job->data, job->size);
+        } else {
+            char hex[65], *record;
+            if (job->record) hash_close(job->title, job->offset, hex);
+            int size = job->record ? asprintf(&record, "%s\t%s", job->record, hex) : -1;
+            if (size > 0) enqueue(record, size + 1);  // Includes null byte.
+            free(job->record);
+            free_title(job->title);
+        }
+        size_t copied = job->data ? job->size : 0;
+        free(job->data);
+        free(job);
+
+        pthread_mutex_lock(&hasher.lock);
+        hasher.pending -= copied;
+    }
+    pthread_mutex_unlock(&hasher.lock);
+    return NULL;
+}
+
+
+// Free a title once the hasher thread is done with it, queued writes may still refer to it. record is the named pipe
+// record to send with the digest, or NULL. Titles that are not hashed are freed right away.
+static void drop_title(struct title *title, char *record, off_t size) {
+    if (!title) return;
+    if (!title->release) {
+        free(record);
+        free_title(title);
+        return;
+    }
+    struct hash_job *job = title->release;
+    job->title = title;
+    job->offset = size;
+    job->record = record;
+    job->closing = true;
+    hash_enqueue(job);
+}
+
+
+// Wrapping open() function call for umask and file descriptor tracking purposes.
+int open(const char *path, int flags, ...) {
+    mode_t mode = 0;
+    if (flags & (O_CREAT | O_TMPFILE)) {
+        va_list args;
+        va_start(args, flags);
+        mode = va_arg(args, int);
+        va_end(args);
+    }
+
     // Don't intercept calls that don't open MKV files in /output.
-    if (!is_mkv(path)) return real_open(path, flags, mode);
+    if (!is_mkv(path)) {
+        int fd = real_open(path, flags, mode);
+        drop_title(untrack(fd), NULL, 0);  // Stale entry, the MKV descriptor was closed behind our back.
+        if (trace.fds && fd >= 0 && fd < fd_table_size) {
+            struct stat st;
+            trace.fds[fd] = !strncmp("/dev/", path, 5) && fstat(fd, &st) == 0 && st.st_rdev == trace.rdev
+                && (S_ISBLK(st.st_mode) || S_ISCHR(st.st_mode));
+        }
+        return fd;
+    }
 
     // Call with new mode (from touch command source code).
-    return real_open(path, flags, S_IRUSR | S_IWUSR | S_IRGRP | S_IWGRP | S_IROTH | S_IWOTH);
+    int fd = real_open(path, flags, S_IRUSR | S_IWUSR | S_IRGRP | S_IWGRP | S_IROTH | S_IWOTH);
+    if (fd < 0 || fd >= fd_table_size) return fd;
+
+    // Track file descriptor so close() can find it without resolving /proc/self/fd.
+    struct title *title = calloc(1, sizeof *title);
+    if (!title || !(title->path = strdup(path))) {
+        free(title);
+        return fd;
+    }
+    title->opened_ns = now_ns();
+    title->chunk = -1;
+    if (hasher.running) title->release = calloc(1, sizeof *title->release);  // Not hashed if this fails.
+    drop_title(__atomic_exchange_n(&fd_table[fd], title, __ATOMIC_ACQ_REL), NULL, 0);
+    if (io.fallocate) manage(title, fd, 0);  // Preallocate the first chunk before any data is written.
+    return fd;
+}
+
+
+// Preallocate ahead of and flush/drop behind the write cursor. end is the offset just past the last write.
+static void manage(struct title *title, int fd, off_t end) {
+    if (end > title->end) title->end = end;
+
+    // Keep at least one chunk allocated past the write cursor.
+    while (io.fallocate && title->allocated >= 0 && title->allocated < title->end + io.fallocate) {
+        if (fallocate(fd, FALLOC_FL_KEEP_SIZE, title->allocated, io.fallocate) == -1) {
+            title->allocated = -1;  // Not supported (e.g. NFS), stop trying for this file.
+            break;
+        }
+        title->allocated += io.fallocate;
+    }
+
+    // Every window: start writeback of the new window, then wait for and drop the one before it.
+    if ((!io.writeback && !io.drop_cache) || title->end < title->flushed + io.window) return;
+    off_t previous = title->flushed;
+    if (io.writeback) sync_file_range(fd, previous, title->end - previous, SYNC_FILE_RANGE_WRITE);
+    title->flushed = title->end;
+    if (io.drop_cache && previous > title->dropped) {
+        sync_file_range(
+            fd, title->dropped, previous - title->dropped,
+            SYNC_FILE_RANGE_WAIT_BEFORE | SYNC_FILE_RANGE_WRITE | SYNC_FILE_RANGE_WAIT_AFTER
+        );
+        posix_fadvise(fd, title->dropped, previous - title->dropped, POSIX_FADV_DONTNEED);
+        title->dropped = previous;
+    }
+}
+
+
+// Record one write call against a tracked title.
+static void account(struct title *title, ssize_t written, long long elapsed_ns) {
+    __atomic_fetch_add(&title->hist[bucket(elapsed_ns)], 1, __ATOMIC_RELAXED);
+    __atomic_fetch_add(&title->writes, 1, __ATOMIC_RELAXED);
+    if (written > 0) __atomic_fetch_add(&title->bytes, written, __ATOMIC_RELAXED);
+}
+
+
+// Format a title's statistics as a named pipe record. Returns record size including the null byte, or -1.
+static int format_record(struct title *title, char **record) {
+    char hist[HIST_BUCKETS * 21] = "";
+    size_t len = 0;
+    for (int i = 0; i < HIST_BUCKETS; i++) {
+        len += snprintf(hist + len, sizeof hist - len, "%s%lu", i ? "," : "", title->hist[i]);
+    }
+    int size = asprintf(
+        record, "%s\t%llu\t%lu\t%lld\t%s%c",
+        title->path, title->bytes, title->writes, (now_ns() - title->opened_ns) / 1000, hist, 0
+    );
+    if (size < 0) *record = NULL;
+    return size;
+}
+
+
+// Wrapping write() function call for instrumentation purposes.
+ssize_t write(int fd, const void *buf, size_t count) {
+    struct title *title = tracked(fd);
+    if (!title) return real_write(fd, buf, count);
+
+    long long start = now_ns();
+    ssize_t ret = real_write(fd, buf, count);
+    account(title, ret, now_ns() - start);
+    if (ret <= 0 || !(io.fallocate || io.writeback || io.drop_cache || title->release)) return ret;
+    off_t end = lseek(fd, 0, SEEK_CUR);
+    if (title->release) hash_write(title, end - ret, buf, ret);
+    if (io.fallocate || io.writeback || io.drop_cache) manage(title, fd, end);
+    return ret;
+}
+
+
+// Wrapping pwrite() function call for instrumentation purposes.
+ssize_t pwrite(int fd, const void *buf, size_t count, off_t offset) {
+    struct title *title = tracked(fd);
+    if (!title) return real_pwrite(fd, buf, count, offset);
+
+    long long start = now_ns();
+    ssize_t ret = real_pwrite(fd, buf, count, offset);
+    account(title, ret, now_ns() - start);
+    if (ret > 0 && title->release) hash_write(title, offset, buf, ret);
+    if (ret > 0 && (io.fallocate || io.writeback || io.drop_cache)) manage(title, fd, offset + ret);
+    return ret;
+}
+
+
+// Wrapping read() function call for I/O tracing purposes.
+ssize_t read(int fd, void *buf, size_t count) {
+    if (!is_device(fd)) return real_read(fd, buf, count);
+
+    off_t offset = lseek(fd, 0, SEEK_CUR);
+    long long start = now_ns();
+    ssize_t ret = real_read(fd, buf, count);
+    trace_read(offset >= 0 ? offset / SECTOR_SIZE : -1, ret, ret < 0, now_ns() - start);
+    return ret;
+}
+
+
+// Wrapping pread() function call for I/O tracing purposes.
+ssize_t pread(int fd, void *buf, size_t count, off_t offset) {
+    if (!is_device(fd)) return real_pread(fd, buf, count, offset);
+
+    long long start = now_ns();
+    ssize_t ret = real_pread(fd, buf, count, offset);
+    trace_read(offset / SECTOR_SIZE, ret, ret < 0, now_ns() - start);
+    return ret;
+}
+
+
+// Wrapping ioctl() function call for I/O tracing purposes. SG_IO is how makemkvcon talks to the drive.
+int ioctl(int fd, unsigned long request, ...) {
+    va_list args;
+    va_start(args, request);
+    void *arg = va_arg(args, void *);
+    va_end(args);
+    if (!is_device(fd)) return real_ioctl(fd, request, arg);
+
+    long long start = now_ns();
+    int ret = real_ioctl(fd, request, arg);
+    if (request == SG_IO) {
+        trace_sg_io(arg, ret, now_ns() - start);
+    } else {
+        __atomic_fetch_add(&trace.ioctls, 1, __ATOMIC_RELAXED);
+    }
+    return ret;
 }
 
 
 // Wrapping close() function call for named pipe purposes.
 int close(int fd) {
-    // First resolve file descriptor to real path of file before closing.
-    char link_name[sizeof("/proc/self/fd/") + 4];
-    snprintf(link_name, sizeof link_name, "/proc/self/fd/%d", fd);  // Set link_name to something like: /proc/self/fd/16
-    char *path = realpath(link_name, NULL);
+    if (trace.fds && fd >= 0 && fd < fd_table_size) trace.fds[fd] = false;
 
-    // Make sure file is MKV and not empty. Close fd here since we don't need it open anymore.
+    // Anything not opened as an MKV file goes straight through.
+    struct title *title = untrack(fd);
+    if (!title) return real_close(fd);
+
+    // Make sure file is not empty. Close fd here since we don't need it open anymore.
+    struct stat st;
+    bool stat_ok = fstat(fd, &st) == 0;
+    bool write_fifo = stat_ok && st.st_size > 0;
+    if (io.fallocate && stat_ok && title->allocated > st.st_size) ftruncate(fd, st.st_size);  // Release the rest.
     int ret = real_close(fd);
-    bool write_fifo = is_mkv(path) && not_empty(path);
 
-    // Write to named pipe.
-    if (fifo_fd > 0 && write_fifo) {
-        write(fifo_fd, path, strlen(path) + 1);  // Include null byte. Bash script looks for it.
-        fsync(fifo_fd);
+    // Hand record to the writer thread, or to the hasher thread which appends the digest first. Hashed titles are
+    // always freed by the hasher thread, even without a record, since their queued writes still refer to them.
+    char *record = NULL;
+    int size = queue.running && write_fifo ? format_record(title, &record) : -1;
+    if (size > 0 && !title->release) {
+        enqueue(record, size);  // Includes null byte. Bash script looks for it.
+        record = NULL;
     }
-
-    free(path);
+    drop_title(title, record, write_fifo ? st.st_size : 0);
     return ret;
 }
@@ -1,5 +1,8 @@
 """Test boolean environment variable options."""
 
+import contextlib
+import json
+import sqlite3
 import subprocess
 
 import pytest
@@ -30,12 +33,20 @@ def test_debug(debug):
         assert b'makemkvcon mkv' in stderr
         # Assert eject is verbose.
         assert b'\neject: device name is' in stdout
+        # Assert startup timing is printed.
+        assert b'\nStartup: env ' in stdout
+        assert b', first event ' in stdout
+        # Assert raw progress is printed.
+        assert b'\nCurrent progress - ' in stdout
     else:
         assert b'+ env' not in stderr
         assert b'\nID_FS_TYPE=udf' not in stdout
         assert b'makemkvcon mkv' not in stderr
         assert b'\neject: device name is' not in stdout
+        assert b'\nStartup: env ' not in stdout
+        assert b'\nCurrent progress - ' not in stdout
     assert b'\nCurrent operation: Scanning CD-ROM devices' in stdout
+    assert b'\nProgress: title 0% ETA --:--:--, total 0% ETA --:--:--, ' in stdout
     assert b'\nDone after 00:00:' in stdout
 
 
@@ -91,3 +102,118 @@ def test_no_eject(no_eject):
         assert b'\nEjecting...' in stdout
     assert b'\nCurrent operation: Scanning CD-ROM devices' in stdout
     assert b'\nDone after 00:00:' in stdout
+
+
+@pytest.mark.parametrize('main_feature', [None, False, True])
+@pytest.mark.usefixtures('cdemu')
+def test_main_feature(tmpdir, main_feature):
+    """Test MAIN_FEATURE environment variable.
+
+    :param py.path.local tmpdir: pytest fixture.
+    :param bool main_feature: Set environment variable to 'true', 'false', or don't set.
+    """
+    if main_feature is True:
+        args = ['-e', 'MAIN_FEATURE=true']
+    elif main_feature is False:
+        args = ['-e', 'MAIN_FEATURE=false']
+    else:
+        args = list()
+
+    # Docker run.
+    output = tmpdir.ensure_dir('output')
+    stdout, stderr = pytest.run(args=args, output=output)
+
+    # Verify.
+    if main_feature is True:
+        assert b'\nScanning disc...' in stdout
+        assert b'\nSelected titles: 0 of 1, skipping 0 bytes (00:00:00 of video).' in stdout
+    else:
+        assert b'\nScanning disc...' not in stdout
+    pytest.verify(output)
+
+
+@pytest.mark.parametrize('force', [False, True])
+@pytest.mark.usefixtures('cdemu')
+def test_catalog(tmpdir, force):
+    """Test CATALOG and FORCE environment variables.
+
+    :param py.path.local tmpdir: pytest fixture.
+    :param bool force: Set FORCE=true on the second run.
+    """
+    output = tmpdir.ensure_dir('output')
+    args = ['-e', 'CATALOG=true']
+
+    # Docker run twice.
+    pytest.run(args=args, output=output)
+    stdout = pytest.run(args=args + (['-e', 'FORCE=true'] if force else []), output=output)[0]
+
+    # Verify.
+    with contextlib.closing(sqlite3.connect(str(output.join('.catalog')))) as connection:
+        rips = connection.execute('SELECT status, titles FROM rips').fetchall()
+        seconds = connection.execute('SELECT seconds FROM titles').fetchall()
+    output.join('.catalog').remove()
+    ripped = output.listdir('Sample_*', sort=True)
+    if force:
+        assert b'Disc already ripped' not in stdout
+        assert rips == [('done', 1), ('done', 1)]
+        assert len(seconds) == 2
+        assert len(ripped) == 2
+        ripped[0].move(tmpdir.join('first'))
+    else:
+        assert b'Disc already ripped to /output/Sample_2017-04-15-15-16-14-00_' in stdout
+        assert b'\nRipping...' not in stdout
+        assert rips == [('done', 1)]
+        assert len(seconds) == 1
+    assert all(row[0] > 0 for row in seconds)  # Durations come from the disc scan.
+    pytest.verify(output)
+
+
+@pytest.mark.usefixtures('cdemu')
+def test_trace(tmpdir):
+    """Test TRACE environment variable.
+
+    :param py.path.local tmpdir: pytest fixture.
+    """
+    output = tmpdir.ensure_dir('output')
+    hook = tmpdir.join('hook-post-title.sh')
+    hook.write('sleep 0.1')
+
+    # Docker run.
+    pytest.run(args=['-e', 'TRACE=true', '-v', '{}:/hook-post-title.sh:ro'.format(hook)], output=output)
+
+    # Verify.
+    rip = [p for p in output.listdir() if p.check(dir=True)][0]
+    events = json.loads(rip.join('trace.json').read())['traceEvents']
+    names = [e['name'] for e in events]
+    for name in ('env', 'prepare', 'setup', 'makemkvcon', 'title00.mkv', 'hook-post-title', 'move_back', 'eject'):
+        assert name in names
+    spans = [e for e in events if e['ph'] in 'BE']
+    assert all(a['ts'] <= b['ts'] for a, b in zip(spans, spans[1:]) if a['tid'] == b['tid'])
+    assert [e['ph'] for e in events if e['name'] == 'makemkvcon'] == ['B', 'E']
+
+
+@pytest.mark.usefixtures('cdemu')
+def test_checksum(tmpdir):
+    """Test CHECKSUM environment variable and verifying the manifest.
+
+    :param py.path.local tmpdir: pytest fixture.
+    """
+    output = tmpdir.ensure_dir('output')
+    hook = tmpdir.join('hook-post-title.sh')
+    hook.write('echo "digest of $(basename $TITLE_PATH): $TITLE_DIGEST"')
+
+    # Docker run.
+    stdout = pytest.run(args=['-e', 'CHECKSUM=true', '-v', '{}:/hook-post-title.sh:ro'.format(hook)], output=output)[0]
+
+    # Verify manifest.
+    rip = [p for p in output.listdir() if p.check(dir=True)][0]
+    name, size, digest = rip.join('manifest').read().splitlines()[0].split('\t')
+    assert name == 'title00.mkv'
+    assert int(size) == rip.join('title00.mkv').size()
+    assert 'digest of title00.mkv: {}'.format(digest).encode('utf8') in stdout
+
+    # Verify the rip against it.
+    command = ['docker', 'run', '-v', '{}:/output'.format(output), 'robpol86/makemkv', '/rip.sh', 'verify']
+    stdout = pytest.run(command)[0]
+    assert b'OK /output/%s/title00.mkv\n' % rip.basename.encode('utf8') in stdout
+    assert b'Verified 1 titles after ' in stdout
@@ -1,5 +1,6 @@
 """Test integer/numeric environment variable options."""
 
+import py
 import pytest
 
 
@@ -50,3 +51,29 @@ def test_umask(tmpdir, umask):
         pytest.verify(output, modes=('drwxrwxrwx', '-rw-rw-rw-'))
     else:
         pytest.verify(output, modes=('drwxr-xr-x', '-rw-r--r--'))
+
+
+@pytest.mark.parametrize('source', ['dev', 'iso'])
+@pytest.mark.usefixtures('cdemu')
+def test_rip_jobs(tmpdir, source):
+    """Test RIP_JOBS environment variable. Only ISO images and folders are ripped by several makemkvcon processes.
+
+    :param py.path.local tmpdir: pytest fixture.
+    :param str source: Rip the optical device or the sample ISO image.
+    """
+    output = tmpdir.ensure_dir('output')
+    args = ['-e', 'RIP_JOBS=4']
+    if source == 'iso':
+        sample = py.path.local(__file__).dirpath().join('sample.iso')
+        args += ['-e', 'SOURCE=iso:/input/sample.iso', '-v', '{}:/input/sample.iso:ro'.format(sample)]
+
+    # Docker run.
+    stdout = pytest.run(args=args, output=output)[0]
+
+    # Verify. The sample has one title so it's still ripped by one makemkvcon, but the title list comes from a scan.
+    if source == 'iso':
+        assert b'\nSelected titles: 0 of 1, skipping 0 bytes' in stdout
+    else:
+        assert b'\nSelected titles: ' not in stdout
+    assert b' makemkvcon processes took ' not in stdout
+    pytest.verify(output, gid=1000, uid=1000)
@@ -32,3 +32,47 @@ def test_devname(tmpdir, devname):
     assert b'+ eject --verbose %s' % (devname or '/dev/cdrom').encode('utf8') in stderr
     assert b'\nDone after 00:00:' in stdout
     pytest.verify(output, gid=1000, uid=1000)
+
+
+@pytest.mark.usefixtures('cdemu')
+def test_rip_mode_backup(tmpdir):
+    """Test RIP_MODE=backup environment variable.
+
+    :param py.path.local tmpdir: pytest fixture.
+    """
+    output = tmpdir.ensure_dir('output')
+
+    # Docker run.
+    stdout, stderr = pytest.run(args=['-e', 'RIP_MODE=backup', '-e', 'REMUX_JOBS=2'], output=output)
+
+    # Verify.
+    assert b'\nBacking up disc...' in stdout
+    assert stdout.index(b'\nEjecting...') < stdout.index(b'\nRemuxing 1 titles, 2 at a time...')
+    assert b'makemkvcon backup --decrypt' in stderr
+    assert b'\nDone after 00:00:' in stdout
+    pytest.verify(output, gid=1000, uid=1000)
+
+
+@pytest.mark.usefixtures('cdemu')
+def test_metrics_dir(tmpdir):
+    """Test METRICS_DIR environment variable.
+
+    :param py.path.local tmpdir: pytest fixture.
+    """
+    output = tmpdir.ensure_dir('output')
+    metrics = tmpdir.ensure_dir('metrics')
+
+    # Docker run twice, the counters carry over.
+    for _ in range(2):
+        pytest.run(args=['-v', '{}:/metrics'.format(metrics), '-e', 'METRICS_DIR=/metrics'], output=output)
+
+    # Verify.
+    assert [p.basename for p in metrics.listdir()] == ['makemkv_cdrom.prom']
+    contents = metrics.join('makemkv_cdrom.prom').read()
+    assert '# TYPE makemkv_rip_duration_seconds gauge\nmakemkv_rip_duration_seconds{source="cdrom"} ' in contents
+    assert '\nmakemkv_rip_titles{source="cdrom"} 1\n' in contents
+    assert '\nmakemkv_title_bytes{source="cdrom",title="title00.mkv"} ' in contents
+    assert '\nmakemkv_rip_read_mbps{source="cdrom"} ' in contents
+    assert '\nmakemkv_eject_seconds{source="cdrom"} ' in contents
+    assert '\nmakemkv_rips_total{source="cdrom",status="done"} 2\n' in contents
+    assert '# TYPE makemkv_failures_total counter\n' in contents
@@ -10,12 +10,14 @@ import pytest
 HERE = os.path.dirname(__file__)
 
 
+@pytest.mark.parametrize('space_check', ['', 'refuse', 'fit'])
 @pytest.mark.usefixtures('cdemu')
-def test_low_space(request, tmpdir):
+def test_low_space(request, tmpdir, space_check):
     """Test low free space handling.
 
     :param request: pytest fixture.
     :param py.path.local tmpdir: pytest fixture.
+    :param str space_check: Value of SPACE_CHECK environment variable.
     """
     # Create a 5 MiB filesystem container.
     fs_bin = tmpdir.join('fs.bin')
@@ -30,8 +32,40 @@ def test_low_space(request, tmpdir):
 
     # Docker run.
     with pytest.raises(subprocess.CalledProcessError) as exc:
-        pytest.run(output=output)
-    assert b'Terminating MakeMKV due to low disk space.' in exc.value.stderr
+        pytest.run(args=['-e', 'SPACE_CHECK={}'.format(space_check)], output=output)
+    if space_check == 'refuse':
+        assert b'ERROR: Disc needs ' in exc.value.stderr
+        assert b'Ripping...' not in exc.value.output
+    elif space_check == 'fit':
+        assert b'ERROR: No title fits in the ' in exc.value.stderr
+        assert b'Ripping...' not in exc.value.output
+    else:
+        assert b'Terminating MakeMKV due to low disk space.' in exc.value.stderr
+    pytest.verify_failed_file(output)
+
+
+@pytest.mark.usefixtures('cdemu')
+def test_migrate_error(tmpdir):
+    """Test that a title stays on the scratch volume when copying it to /output fails.
+
+    :param py.path.local tmpdir: pytest fixture.
+    """
+    output = tmpdir.ensure_dir('output')
+    scratch = tmpdir.ensure_dir('scratch')
+    fcopy = tmpdir.join('fcopy')
+    fcopy.write('#!/bin/bash\nexit 1\n')
+    fcopy.chmod(0o755)
+    args = ['-v', '{}:/scratch'.format(scratch), '-v', '{}:/fcopy:ro'.format(fcopy)]
+
+    # Docker run.
+    with pytest.raises(subprocess.CalledProcessError) as exc:
+        pytest.run(args=args, output=output)
+
+    # Verify.
+    assert b' exit 1: migrate /scratch/' in exc.value.output
+    assert b'ERROR: 1 queued job(s) failed.' in exc.value.stderr
+    assert [p.basename for p in scratch.visit('*.mkv')] == ['title00.mkv']
+    assert not list(output.visit('*.mkv'))
     pytest.verify_failed_file(output)
 
 
@@ -85,6 +119,40 @@ def test_rip_error(request, tmpdir):
     assert caught is True
     pytest.verify_failed_file(output)
 
+    # Retry with the intact ISO, should resume in the same directory.
+    py.path.local(__file__).dirpath().join('sample.iso').copy(iso)
+    pytest.cdload(iso)
+    stdout = pytest.run(output=output)[0]
+    assert b'\nResuming Sample_2017-04-15-15-16-14-00_' in stdout
+    assert b': 0 titles already ripped, 1 to go.' in stdout
+    pytest.verify(output)
+
+
+@pytest.mark.usefixtures('cdemu')
+def test_resume_complete(tmpdir):
+    """Test resuming a rip that failed after its title was done. The title must be kept, not ripped again.
+
+    :param py.path.local tmpdir: pytest fixture.
+    """
+    output = tmpdir.ensure_dir('output')
+    hook = tmpdir.join('hook-post-rip.sh')
+    hook.write('false')
+
+    # Docker run with a failing hook after makemkvcon is done.
+    with pytest.raises(subprocess.CalledProcessError):
+        pytest.run(args=['-v', '{}:/hook-post-rip.sh:ro'.format(hook)], output=output)
+    pytest.verify_failed_file(output)
+    title = output.listdir('Sample_*')[0].join('.rip', 'title00.mkv')
+    mtime = title.mtime()
+
+    # Docker run again, should resume and keep the title.
+    stdout = pytest.run(output=output)[0]
+    assert b'\nResuming Sample_2017-04-15-15-16-14-00_' in stdout
+    assert b': 1 titles already ripped, 0 to go.' in stdout
+    assert b'Title done: ' not in stdout
+    assert output.listdir('Sample_*')[0].join('title00.mkv').mtime() == mtime
+    pytest.verify(output)
+
 
 def test_no_disc(tmpdir):
     """Test no disc in device handling.
@@ -121,3 +189,39 @@ def test_no_device(tmpdir, devname):
         assert b'Device %s not a block-special file.' % devname.encode('utf8') in exc.value.stderr
     else:
         assert b'ERROR: Unable to find optical device.' in exc.value.stderr
+
+
+@pytest.mark.parametrize('log,code,message', [
+    ('ok', 'unknown', None),
+    ('low_space', 'low_space', b'ERROR: Terminating MakeMKV due to low disk space.'),
+    ('title_failed', 'title_failed', b'ERROR: One or more titles failed.'),
+    ('read_errors', 'read_error', b'ERROR: Too many read errors, the disc is probably damaged.'),
+    ('scratched', 'unknown', None),
+    ('no_key', 'no_key', b'ERROR: Unable to get the keys to decrypt the disc.'),
+])
+def test_failure_replay(log, code, message):
+    """Replay recorded makemkvcon output through the output filter at full speed and check the failure code.
+
+    Lines classified on the way are forgotten when makemkvcon succeeds, so they don't become the code of later failures.
+
+    :param str log: Name of the log file in tests/replay.
+    :param str code: Expected FAILURE_CODE.
+    :param bytes message: Expected error message if the filter should stop makemkvcon.
+    """
+    script = ('source /env.sh; set -o pipefail; makemkvcon() {{ cat /replay/{}.log; }}; sudo() {{ "${{@:3}}"; }}; '
+              'preload=() args=() DIR_WORKING=/tmp; (makemkvcon_mkv replay 0); ret=$?; failure_code; '
+              'echo "FAILURE_CODE=$FAILURE_CODE exit=$ret"').format(log)
+    command = ['docker', 'run', '-v', '{}:/replay:ro'.format(os.path.join(HERE, 'replay')), 'robpol86/makemkv',
+               'bash', '-c', script]
+
+    # Docker run.
+    stdout, stderr = pytest.run(command)
+
+    # Verify.
+    assert 'FAILURE_CODE={} exit={}'.format(code, 1 if message else 0).encode('utf8') in stdout
+    if message:
+        assert message in stderr
+        assert stdout.count(b' occurred while reading ') == (50 if log == 'read_errors' else 0)
+    else:
+        assert b'ERROR:' not in stderr
+        assert b'\nCopy complete. 1 titles saved.' in stdout
@@ -58,6 +58,12 @@ def test_success(tmpdir):
         assert b'END OF HOOK: /hook-%s.sh' % hook.encode('utf8') in stderr
         if hook == 'post-title':
             assert re.compile(br'^TITLE_PATH=/output/Sample[a-zA-Z0-9_/.-]+/title00\.mkv$', re.MULTILINE).search(stdout)
+            assert re.compile(br'^TITLE_BYTES=173452[01][0-9]$', re.MULTILINE).search(stdout)
+            assert re.compile(br'^TITLE_SECONDS=[0-9]+\.[0-9]{3}$', re.MULTILINE).search(stdout)
+            assert re.compile(br'^TITLE_MBPS=[0-9]+\.[0-9]{2}$', re.MULTILINE).search(stdout)
+            assert re.compile(br'^TITLE_WRITE_HIST=[0-9]+(,[0-9]+){23}$', re.MULTILINE).search(stdout)
+    assert re.compile(br'^Title done: title00\.mkv 173452[01][0-9] bytes in ', re.MULTILINE).search(stdout)
+    assert re.compile(br'^Done after 00:00:[0-9]{2} with Sample\S+ \(1 titles, ', re.MULTILINE).search(stdout)
     assert stderr.count(b'\nEND OF HOOK: ') == len(hooks)  # Verify no other hooks fired.
     pytest.verify(output)
 
@@ -215,3 +221,38 @@ def test_wait_nested(tmpdir, fail):
 
     # Verify.
     assert b'do_wait done!' in stdout
+
+
+@pytest.mark.parametrize('fail', [False, True])
+@pytest.mark.usefixtures('cdemu')
+def test_queue(tmpdir, fail):
+    """Test queueing jobs from a hook.
+
+    :param py.path.local tmpdir: pytest fixture.
+    :param bool fail: Queue a failing job.
+    """
+    with build_image(tmpdir.join('root')) as (root, _, image_ids):
+        post_title = root.ensure('hook-post-title.sh')
+        post_title.write('queue sleep 2\nqueue echo queued job done!\n')
+        if fail:
+            post_title.write('queue false\n', 'a')
+
+    # Docker run.
+    output = tmpdir.ensure_dir('output')
+    if fail:
+        with pytest.raises(subprocess.CalledProcessError) as exc:
+            pytest.run(output=output, image_id=image_ids[0])
+        stdout, stderr = exc.value.output, exc.value.stderr
+    else:
+        stdout, stderr = pytest.run(output=output, image_id=image_ids[0])
+
+    # Verify.
+    assert b'\nqueued job done!' in stdout
+    assert re.compile(br'^Job 1 queued 0s ran [23]s exit 0: sleep 2$', re.MULTILINE).search(stdout)
+    assert re.compile(br'^Job 2 queued [0-9]+s ran 0s exit 0: echo queued job done\\!$', re.MULTILINE).search(stdout)
+    if fail:
+        assert re.compile(br'^Job 3 queued [0-9]+s ran 0s exit 1: false$', re.MULTILINE).search(stdout)
+        assert b'ERROR: 1 queued job(s) failed.' in stderr
+        pytest.verify_failed_file(output)
+    else:
+        pytest.verify(output)
@@ -0,0 +1,103 @@
+"""Test batch ingest of ISO images, ripping all drives at once and the rip daemon."""
+
+import fnmatch
+import subprocess
+import time
+
+import py
+import pytest
+
+
+@pytest.mark.parametrize('fail', [False, True])
+def test_ingest(tmpdir, fail):
+    """Test converting a directory of ISO images without an optical device.
+
+    :param py.path.local tmpdir: pytest fixture.
+    :param bool fail: Add an ISO that isn't a disc image.
+    """
+    source = tmpdir.ensure_dir('input')
+    for name in ('one.iso', 'two.iso'):
+        py.path.local(__file__).dirpath().join('sample.iso').copy(source.join(name))
+    if fail:
+        source.join('bad.iso').write('not a disc')
+    output = tmpdir.ensure_dir('output')
+    command = ['docker', 'run', '-v', '{}:/input:ro'.format(source), '-v', '{}:/output'.format(output),
+               '-e', 'INGEST_JOBS=2', 'robpol86/makemkv', '/ingest.sh']
+
+    # Docker run.
+    if fail:
+        with pytest.raises(subprocess.CalledProcessError) as exc:
+            pytest.run(command)
+        stdout, stderr = exc.value.output, exc.value.stderr
+    else:
+        stdout, stderr = pytest.run(command)
+
+    # Verify.
+    assert b'Ingesting %d sources, 2 at a time...' % (3 if fail else 2) in stdout
+    assert b'\n[one.iso] Done after 00:00:' in stdout
+    assert b'\n[two.iso] Done after 00:00:' in stdout
+    assert b'\nOK iso:/input/one.iso: ' in stdout
+    assert b'\nFinished 2 of %d sources after 00:00:' % (3 if fail else 2) in stdout
+    assert b', 2 titles, ' in stdout
+    ripped = sorted(p.basename for p in output.listdir() if fnmatch.fnmatch(p.basename, 'Sample_*'))
+    assert len(ripped) == 2
+    for name in ripped:
+        assert [p.basename for p in output.join(name).listdir()] == ['title00.mkv']
+    if fail:
+        assert b'\nFAILED iso:/input/bad.iso' in stdout
+        assert b'ERROR: 1 source(s) failed.' in stderr
+
+
+@pytest.mark.usefixtures('cdemu')
+def test_drives(tmpdir):
+    """Test ripping every attached drive with drives.sh.
+
+    :param py.path.local tmpdir: pytest fixture.
+    """
+    output = tmpdir.ensure_dir('output')
+    command = ['docker', 'run', '--device=/dev/sr0', '-v', '{}:/output'.format(output), '-e', 'STATUS_INTERVAL=1',
+               'robpol86/makemkv', '/drives.sh']
+
+    # Docker run.
+    stdout = pytest.run(command)[0]
+
+    # Verify.
+    assert b'Ripping 1 drives: /dev/sr0' in stdout
+    assert b'\n[sr0] Ejecting...' in stdout
+    assert b'\nStatus after 00:00:' in stdout
+    assert b' | sr0: ' in stdout
+    assert b'\nFinished 1 of 1 sources after 00:00:' in stdout
+    pytest.verify(output, gid=1000, uid=1000)
+
+
+@pytest.mark.usefixtures('cdemu')
+def test_daemon(tmpdir):
+    """Test the daemon ripping a disc already in the drive and then waiting for the next one.
+
+    :param py.path.local tmpdir: pytest fixture.
+    """
+    output = tmpdir.ensure_dir('output')
+    command = ['docker', 'run', '-d', '--device=/dev/sr0', '-v', '{}:/output'.format(output), '-e', 'DAEMON_POLL=1',
+               'robpol86/makemkv', '/daemon.sh']
+
+    # Docker run.
+    cid = pytest.run(command)[0].strip()
+    try:
+        for _ in range(120):
+            stdout = pytest.run(['docker', 'logs', cid])[0]
+            if b'\nOK dev:/dev/sr0: ' in stdout:
+                break
+            time.sleep(1)
+        state = pytest.run(['docker', 'inspect', '-f', '{{.State.Running}}', cid])[0]
+    finally:
+        pytest.run(['docker', 'rm', '-f', cid])
+
+    # Verify.
+    assert b'Watching 1 drives for discs: /dev/sr0' in stdout
+    assert b'\nDisc inserted in /dev/sr0: ' in stdout
+    assert b'\n[sr0] First sector read ' in stdout
+    assert b's after disc insertion\n' in stdout
+    assert b'\n[sr0] Ejecting...' in stdout
+    assert b'\nOK dev:/dev/sr0: ' in stdout
+    assert state.strip() == b'true'
+    pytest.verify(output, gid=1000, uid=1000)
@@ -41,3 +41,66 @@ def test_volume(tmpdir, volume):
         pass
     else:
         raise NotImplementedError
+
+
+@pytest.mark.usefixtures('cdemu')
+def test_scratch(tmpdir):
+    """Test ripping to a scratch volume with titles migrated to /output.
+
+    :param py.path.local tmpdir: pytest fixture.
+    """
+    output = tmpdir.ensure_dir('output')
+    scratch = tmpdir.ensure_dir('scratch')
+    args = ['-v', '{}:/scratch'.format(scratch)]
+
+    # Docker run.
+    stdout = pytest.run(args=args, output=output)[0]
+
+    # Verify.
+    assert b'fcopy: /scratch/' in stdout
+    assert b' exit 0: migrate /scratch/' in stdout
+    assert not scratch.listdir()
+    pytest.verify(output, gid=1000, uid=1000, modes=('drwxr-xr-x', '-rw-r--r--'))
+
+
+@pytest.mark.usefixtures('cdemu')
+def test_mirror(tmpdir):
+    """Test copying titles to a mirror volume as they're done.
+
+    :param py.path.local tmpdir: pytest fixture.
+    """
+    output = tmpdir.ensure_dir('output')
+    mirror = tmpdir.ensure_dir('mirror')
+    args = ['-e', 'MIRROR_DIR=/mirror', '-e', 'MIRROR_MBPS=50', '-v', '{}:/mirror'.format(mirror)]
+
+    # Docker run.
+    stdout = pytest.run(args=args, output=output)[0]
+
+    # Verify.
+    assert b' exit 0: mirror /output/' in stdout
+    assert b'\nOK /mirror/' in stdout
+    pytest.verify(output, gid=1000, uid=1000, modes=('drwxr-xr-x', '-rw-r--r--'))
+    pytest.verify(mirror, gid=1000, uid=1000, modes=('drwxr-xr-x', '-rw-r--r--'))
+    assert mirror.listdir()[0].join('title00.mkv').size() == output.listdir()[0].join('title00.mkv').size()
+
+
+@pytest.mark.usefixtures('cdemu')
+def test_cache(tmpdir):
+    """Test reusing disc scans from the cache volume.
+
+    :param py.path.local tmpdir: pytest fixture.
+    """
+    cache = tmpdir.ensure_dir('cache')
+    args = ['-v', '{}:/cache'.format(cache), '-e', 'MAIN_FEATURE=true']
+
+    # Docker run twice.
+    stdout_first, stderr_first = pytest.run(args=args, output=tmpdir.ensure_dir('first'))
+    stdout_second, stderr_second = pytest.run(args=args, output=tmpdir.ensure_dir('second'))
+
+    # Verify.
+    assert b'SCAN CACHE MISS: /cache/' in stderr_first
+    assert b'Using cached disc scan.' not in stdout_first
+    assert b'Using cached disc scan.' in stdout_second
+    assert b'(1 hits, 1 misses, ' in stderr_second
+    assert len(cache.listdir('*.txt')) == 1
+    pytest.verify(tmpdir.join('second'))